@@ -1,2 +1,7 @@
 from .stashapi import *
-from .database import *
\ No newline at end of file
+from .database import *
+from .pipeline import *
+from .archive import *
+from .parallel import *
+from .notify import *
+from .retention import *
\ No newline at end of file
@@ -0,0 +1,190 @@
+import io
+import os
+import zlib
+import logging
+import threading
+import collections
+
+from .stashapi import PoeApi
+
+
+ArchiveEntry = collections.namedtuple(
+    'ArchiveEntry', 'change_id next_id segment offset length')
+
+
+class PageArchive:
+
+    index_name = 'index.tsv'
+    segment_format = 'segment-%06d.gz'
+    segment_size = 256 * 1024 * 1024
+    compress_level = 6
+
+    def __init__(self, directory, segment_size=None, logger=logging):
+        self.directory = directory
+        self.logger = logger
+        if segment_size is not None:
+            self.segment_size = segment_size
+        self.entries = []
+        self.by_change_id = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def record(self, change_id):
+        return ArchiveRecord(self, change_id)
+
+    def append(self, change_id, next_id, content):
+        record = self.record(change_id)
+        record.write(content)
+        record.set_next_id(next_id)
+        record.finish()
+
+    def first(self):
+        return self.entries[0] if self.entries else None
+
+    def find(self, change_id):
+        return self.by_change_id.get(change_id or '')
+
+    def open_entry(self, entry):
+        return open(self._segment_path(entry.segment), 'rb')
+
+    def _load_index(self):
+        path = os.path.join(self.directory, self.index_name)
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as index_file:
+            for line in index_file:
+                change_id, next_id, segment, offset, length = \
+                    line.rstrip('\n').split('\t')
+                self._add_entry(ArchiveEntry(
+                    change_id, next_id, int(segment), int(offset),
+                    int(length)))
+        self.logger.debug(
+            "Loaded %s archived pages from %s",
+            len(self.entries), self.directory)
+
+    def _add_entry(self, entry):
+        self.entries.append(entry)
+        self.by_change_id[entry.change_id] = entry
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, self.segment_format % segment)
+
+    def _store(self, change_id, next_id, compressed):
+        with self._lock:
+            segment = self.entries[-1].segment if self.entries else 0
+            path = self._segment_path(segment)
+            if (os.path.exists(path) and
+                    os.path.getsize(path) + len(compressed) > self.segment_size):
+                segment += 1
+                path = self._segment_path(segment)
+            with open(path, 'ab') as segment_file:
+                offset = segment_file.tell()
+                segment_file.write(compressed)
+            entry = ArchiveEntry(
+                change_id or '', next_id, segment, offset, len(compressed))
+            # The index line is written last so a torn segment is never
+            # referenced.
+            with open(os.path.join(self.directory, self.index_name), 'a',
+                    encoding='utf-8') as index_file:
+                index_file.write("\t".join(str(part) for part in entry) + "\n")
+            self._add_entry(entry)
+            self.logger.debug(
+                "Archived page %s (%s bytes compressed)",
+                entry.change_id, entry.length)
+
+
+class ArchiveRecord:
+
+    def __init__(self, archive, change_id):
+        self.archive = archive
+        self.change_id = change_id
+        self.next_id = None
+        self.finished = False
+        self._buffer = io.BytesIO()
+        # wbits=31 writes a complete gzip member per page
+        self._compressor = zlib.compressobj(archive.compress_level, wbits=31)
+
+    def write(self, chunk):
+        self._buffer.write(self._compressor.compress(chunk))
+
+    def set_next_id(self, next_id):
+        self.next_id = next_id
+        self._maybe_store()
+
+    def finish(self):
+        self._buffer.write(self._compressor.flush())
+        self.finished = True
+        self._maybe_store()
+
+    def _maybe_store(self):
+        if self.finished and self.next_id is not None:
+            self.archive._store(
+                self.change_id, self.next_id, self._buffer.getvalue())
+            self._buffer = None
+
+
+class ArchivedResponse:
+
+    status_code = 200
+
+    def __init__(self, archive, entry):
+        self.archive = archive
+        self.entry = entry
+        self.change_id = entry.change_id or None
+        self.headers = {PoeApi.next_id_header: entry.next_id}
+        self._content = None
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = b''.join(self.iter_content())
+        return self._content
+
+    def iter_content(self, chunk_size=64*1024):
+        if self._content is not None:
+            yield self._content
+            return
+        decompressor = zlib.decompressobj(wbits=31)
+        remaining = self.entry.length
+        with self.archive.open_entry(self.entry) as segment_file:
+            segment_file.seek(self.entry.offset)
+            while remaining > 0:
+                chunk = segment_file.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise EOFError(
+                        "Archive segment %s is truncated" % self.entry.segment)
+                remaining -= len(chunk)
+                yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+
+
+class ReplayPoeApi(PoeApi):
+
+    def __init__(self, archive, next_id=None, stream=None, logger=logging):
+        super().__init__(next_id=next_id, stream=stream, logger=logger)
+        if not isinstance(archive, PageArchive):
+            archive = PageArchive(archive, logger=logger)
+        self.source = archive
+
+    def rate_wait(self):
+        pass
+
+    def set_last_time(self):
+        pass
+
+    def _request(self, next_id=None, slow=False):
+        if next_id is None:
+            entry = self.source.first()
+        else:
+            entry = self.source.find(next_id)
+        if entry is None:
+            raise EOFError("No archived page for change id %s" % next_id)
+        self.logger.info("Replaying stash set: %s", entry.change_id)
+        return ArchivedResponse(self.source, entry)
\ No newline at end of file
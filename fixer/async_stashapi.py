@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import aiohttp
+import rapidjson as json
+
+from .ratelimit import RateLimiter
+from .stashapi import ApiStash, POE_STASH_API_ENDPOINT
+
+
+class AsyncPoeApi:
+
+    api_root = POE_STASH_API_ENDPOINT
+    next_id = None
+    rate = 1.1
+    slow = False
+    retries = 10
+    backoff_factor = 1
+    retry_statuses = (500, 502, 503, 504)
+    request_headers = {'Accept-Encoding': 'gzip, deflate'}
+
+    def __init__(
+            self,
+            next_id=None, rate=None, slow=None, api_root=None, session=None,
+            limiter=None, logger=logging):
+        self.logger = logger
+        self.next_id = next_id
+        if rate is not None:
+            self.rate = rate
+        if slow is not None:
+            self.slow = slow
+        if api_root is not None:
+            self.api_root = api_root
+        self.limiter = limiter or RateLimiter(interval=self.rate, logger=logger)
+        self._session = session
+        self._own_session = session is None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                headers=self.request_headers,
+                connector=aiohttp.TCPConnector(limit_per_host=2))
+        return self._session
+
+    async def close(self):
+        if self._session is not None and self._own_session:
+            await self._session.close()
+            self._session = None
+
+    async def rate_wait(self):
+        delay = self.limiter.reserve()
+        if delay > 0:
+            self.logger.debug("Rate limit wait: %.3fs", delay)
+            await asyncio.sleep(delay)
+
+    def set_last_time(self):
+        self.limiter.restart()
+
+    async def get_next(self):
+        await self.rate_wait()
+        data, self.next_id = await self._get_data(
+            next_id=self.next_id, slow=self.slow)
+        return self.stash_generator(data)
+
+    async def stashes(self, max_pages=None):
+        pages = 0
+        while max_pages is None or pages < max_pages:
+            for stash in await self.get_next():
+                yield stash
+            pages += 1
+
+    def stash_generator(self, data):
+        return ApiStash.from_data(data, logger=self.logger)
+
+    async def _get_data(self, next_id=None, slow=False):
+        params = {}
+        if next_id:
+            self.logger.info("Requesting next stash set: %s" % next_id)
+            params['id'] = next_id
+        else:
+            self.logger.info("Requesting first stash set")
+
+        attempt = 0
+        while True:
+            async with self.session.get(self.api_root, params=params) as req:
+                if slow:
+                    self.set_last_time()
+                self.limiter.update(req.headers, req.status)
+                if req.status == 429:
+                    await self.rate_wait()
+                    continue
+                if req.status in self.retry_statuses and attempt < self.retries:
+                    delay = self.backoff_factor * (2 ** attempt)
+                    attempt += 1
+                    self.logger.warning(
+                        "Stash request failed with %s, retry %s in %ss",
+                        req.status, attempt, delay)
+                    await asyncio.sleep(delay)
+                    continue
+                req.raise_for_status()
+                self.logger.debug("Acquired stash data")
+                content = await req.read()
+                break
+
+        data = json.loads(content)
+        self.logger.debug("Loaded stash data from JSON")
+        if 'next_change_id' not in data:
+            raise KeyError('next_change_id required field not present in response')
+        return (data['stashes'], data['next_change_id'])
\ No newline at end of file
@@ -1,15 +1,28 @@
 import re
 import time
 import logging
+import hashlib
 import sqlalchemy
+import sqlalchemy.dialects.mysql
+import sqlalchemy.dialects.sqlite
+import sqlalchemy.dialects.postgresql
 from sqlalchemy.ext.declarative import declarative_base
 import rapidjson as json
 
+from .stashapi import ApiItem, ApiStash
+from .mods import mod_template, item_mods
+
 PoeDbBase = declarative_base()
 PoeDbMetadata = PoeDbBase.metadata
 
+# Longest an ingest transaction may hold rows, stamped with updated_at
+# when written, before it commits. Readers that page by updated_at
+# reread this many seconds behind their position.
+COMMIT_LAG = 60
+
 class SemiJSON(sqlalchemy.types.TypeDecorator):
     impl = sqlalchemy.UnicodeText
+    cache_ok = True
 
     def load_dialect_impl(self, dialect):
         if dialect.name == 'sqlite':
@@ -38,6 +51,7 @@ class Stash(PoeDbBase):
     stash = sqlalchemy.Column(sqlalchemy.Unicode(255))
     stashType = sqlalchemy.Column(sqlalchemy.Unicode(32), nullable=False)
     public = sqlalchemy.Column(sqlalchemy.Boolean, nullable=False, index=True)
+    content_hash = sqlalchemy.Column(sqlalchemy.String(32))
     created_at = sqlalchemy.Column(
         sqlalchemy.Integer, nullable=False, index=True)
     updated_at = sqlalchemy.Column(
@@ -57,7 +71,7 @@ class Item(PoeDbBase):
         sqlalchemy.String(255), nullable=False, index=True, unique=True)
     stash_id = sqlalchemy.Column(
         sqlalchemy.Integer, sqlalchemy.ForeignKey("stash.id"),
-        nullable=False)
+        nullable=False, index=True)
     h = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
     w = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
     x = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
@@ -105,11 +119,16 @@ class Item(PoeDbBase):
     verified = sqlalchemy.Column(sqlalchemy.Boolean, nullable=False)
     active = sqlalchemy.Column(
         sqlalchemy.Boolean, nullable=False, default=True, index=True)
+    content_hash = sqlalchemy.Column(sqlalchemy.String(32))
     created_at = sqlalchemy.Column(
         sqlalchemy.Integer, nullable=False, index=True)
     updated_at = sqlalchemy.Column(
         sqlalchemy.Integer, nullable=False, index=True)
 
+    __table_args__ = (
+        sqlalchemy.Index('ix_item_updated_at_id', 'updated_at', 'id'),
+        sqlalchemy.Index(
+            'ix_item_league_updated_at_id', 'league', 'updated_at', 'id'),)
 
     def __repr__(self):
         return "<Item(name=%r, id=%s, api_id=%s, typeLine=%r)>" % (
@@ -121,7 +140,8 @@ class Sale(PoeDbBase):
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
     item_id = sqlalchemy.Column(
-        sqlalchemy.Integer, sqlalchemy.ForeignKey("item.id"), nullable=False)
+        sqlalchemy.Integer, sqlalchemy.ForeignKey("item.id"), nullable=False,
+        index=True)
     item_api_id = sqlalchemy.Column(
         sqlalchemy.String(255), nullable=False, index=True, unique=True)
     name = sqlalchemy.Column(
@@ -132,6 +152,9 @@ class Sale(PoeDbBase):
         sqlalchemy.Unicode(255), nullable=False, index=True)
     sale_amount = sqlalchemy.Column(sqlalchemy.Float)
     sale_amount_chaos = sqlalchemy.Column(sqlalchemy.Float)
+    # The item's league, so stats need no join to item. Nullable only so
+    # that older databases can gain it; upgrade_database backfills it.
+    league = sqlalchemy.Column(sqlalchemy.Unicode(64))
     created_at = sqlalchemy.Column(
         sqlalchemy.Integer, nullable=False, index=True)
     item_updated_at = sqlalchemy.Column(
@@ -139,6 +162,12 @@ class Sale(PoeDbBase):
     updated_at = sqlalchemy.Column(
         sqlalchemy.Integer, nullable=False, index=True)
 
+    __table_args__ = (
+        # Covers the running stats query, sale_amount included
+        sqlalchemy.Index(
+            'ix_sale_league_name_currency_time', 'league', 'name',
+            'sale_currency', 'item_updated_at', 'sale_amount'),)
+
     def __repr__(self):
         return "<Sale(id=%s, item_id=%s, item_api_id=%s)>" % (
             self.id, self.item_id, self.item_api_id)
@@ -175,12 +204,59 @@ class CurrencySummary(PoeDbBase):
         sqlalchemy.UniqueConstraint('from_currency', 'to_currency', 'league'),)
 
 
+class Checkpoint(PoeDbBase):
+    __tablename__ = 'checkpoint'
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    name = sqlalchemy.Column(sqlalchemy.Unicode(64), nullable=False)
+    # '' when one cursor covers every league
+    league = sqlalchemy.Column(sqlalchemy.Unicode(64), nullable=False)
+    item_updated_at = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    item_id = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    updated_at = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+
+    __table_args__ = (
+        sqlalchemy.UniqueConstraint('name', 'league'),)
+
+
+class Mod(PoeDbBase):
+    __tablename__ = 'mod'
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    # Mod text with every number replaced by '#'
+    template = sqlalchemy.Column(
+        sqlalchemy.Unicode(255), nullable=False, index=True, unique=True)
+    created_at = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+
+
+class ItemMod(PoeDbBase):
+    __tablename__ = 'item_mod'
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    item_id = sqlalchemy.Column(
+        sqlalchemy.Integer, sqlalchemy.ForeignKey("item.id"),
+        nullable=False, index=True)
+    mod_id = sqlalchemy.Column(
+        sqlalchemy.Integer, sqlalchemy.ForeignKey("mod.id"), nullable=False)
+    mod_type = sqlalchemy.Column(sqlalchemy.String(16), nullable=False)
+    value1 = sqlalchemy.Column(sqlalchemy.Float)
+    value2 = sqlalchemy.Column(sqlalchemy.Float)
+
+    __table_args__ = (
+        sqlalchemy.Index('ix_item_mod_mod_id_value1', 'mod_id', 'value1'),)
+
+
 class PoeDb:
     db_connect = 'sqlite:///poetest.db'
     _safe_uri_re = re.compile(r'(?<=\:)([^:]*?)(?=\@)')
     _session = None
     _engine = None
     _session_maker = None
+    lookup_chunk = 500
+    normalize_mods = False
+    unhashed_fields = frozenset((
+        'api_id', 'created_at', 'updated_at', 'content_hash', 'active',
+        'stash_id'))
 
     stash_simple_fields = [
         "accountName", "lastCharacterName", "stash", "stashType",
@@ -199,65 +275,465 @@ class PoeDb:
         "utilityMods", "verified"]
 
     def insert_api_stash(self, stash, with_items=False, keep_items=False):
-        dbstash = self._insert_or_update_row(
-            Stash, stash, self.stash_simple_fields)
+        read_item = ApiItem.field_reader(self.item_simple_fields)
+        read_stash = ApiStash.field_reader(self.stash_simple_fields)
 
+        items = []
         if with_items:
+            for item in stash.items:
+                values = read_item(item)
+                values['content_hash'] = self._content_hash(values)
+                items.append((item.id, values))
+        stash_values = read_stash(stash)
+        stash_values['content_hash'] = self._stash_hash(
+            stash_values, items if with_items else None)
+
+        dbstash, changed = self._insert_or_update_row(
+            Stash, stash.id, stash_values)
+
+        if with_items and changed:
             self.session.flush()
             self.session.refresh(dbstash)
             self.logger.debug(
                 "Injecting %s items for stash: %s",
                 stash.api_item_count, stash.id)
-            for item in stash.items:
-                self._insert_or_update_row(
-                    Item, item, self.item_simple_fields, stash=dbstash)
-
-    def _invalidate_stash_items(self, dbstash):
-        update = sqlalchemy.sql.expression.update(Item)
-        update = update.where(Item.stash_id == dbstash.id)
-        update = update.values(active=False)
-        self.session.execute(update)
+            written = {}
+            for api_id, values in items:
+                _, item_changed = self._insert_or_update_row(
+                    Item, api_id, values, stash=dbstash)
+                if item_changed:
+                    written[api_id] = values
+            if self.normalize_mods:
+                self._write_item_mods(written)
+            if not keep_items:
+                seen = set(api_id for api_id, _ in items)
+                query = self.session.query(Item.id, Item.api_id)
+                query = query.filter(Item.stash_id == dbstash.id)
+                query = query.filter(Item.active == True)
+                removed = [
+                    row.id for row in query.all() if row.api_id not in seen]
+                if removed:
+                    self._invalidate_stash_items([dbstash.id], removed)
+            if items:
+                self._items_written(dbstash.updated_at)
+
+    def insert_api_stashes(self, stashes, with_items=False, keep_items=False):
+        now = int(time.time())
+        read_stash = ApiStash.field_reader(self.stash_simple_fields)
+        read_item = ApiItem.field_reader(self.item_simple_fields)
+
+        stash_rows = {}
+        stash_items = {}
+        for stash in stashes:
+            row = self._simple_row(stash, read_stash, now)
+            items = None
+            if with_items:
+                items = []
+                for item in stash.items:
+                    item_row = self._simple_row(item, read_item, now)
+                    item_row['content_hash'] = self._content_hash(item_row)
+                    item_row['active'] = True
+                    items.append((item.id, item_row))
+                stash_items[stash.id] = items
+            row['content_hash'] = self._stash_hash(row, items)
+            stash_rows[stash.id] = row
+
+        # Stashes whose content hash is unchanged are skipped with
+        # their items, so writes follow real churn.
+        known = dict(
+            (row.api_id, row.content_hash) for row in self._lookup_rows(
+                Stash.api_id, stash_rows.keys(),
+                Stash.api_id, Stash.content_hash))
+        changed = [
+            row for api_id, row in stash_rows.items()
+            if known.get(api_id, None) != row['content_hash']]
+        self.logger.debug(
+            "%s of %s stashes changed", len(changed), len(stash_rows))
+        self._upsert_rows(Stash, changed)
+
+        if not with_items or not changed:
+            return
+
+        stash_ids = self._lookup_ids(Stash, (row['api_id'] for row in changed))
+        current = {}
+        for row in self._lookup_rows(
+                Item.stash_id, stash_ids.values(),
+                Item.id, Item.api_id, Item.stash_id, Item.content_hash,
+                Item.active):
+            current[row.api_id] = row
+
+        item_rows = {}
+        seen = set()
+        for stash_row in changed:
+            stash_id = stash_ids[stash_row['api_id']]
+            for api_id, item_row in stash_items[stash_row['api_id']]:
+                seen.add(api_id)
+                old = current.get(api_id, None)
+                if (old is not None and
+                        old.active and
+                        old.stash_id == stash_id and
+                        old.content_hash == item_row['content_hash']):
+                    continue
+                item_row['stash_id'] = stash_id
+                item_rows[api_id] = item_row
+
+        if not keep_items:
+            removed = [
+                row.id for api_id, row in current.items()
+                if row.active and api_id not in seen]
+            if removed:
+                # Only while still in these stashes: a concurrent writer
+                # may have moved the item somewhere else meanwhile
+                self._invalidate_stash_items(
+                    stash_ids.values(), removed, in_stashes=True)
+        self.logger.debug(
+            "Writing %s changed items of %s",
+            len(item_rows), sum(len(items) for items in stash_items.values()))
+        self._upsert_rows(Item, list(item_rows.values()))
+        if self.normalize_mods:
+            self._write_item_mods(item_rows)
+        if item_rows:
+            self._items_written(now)
+
+    def lookup_sales(self, item_api_ids):
+        rows = self._lookup_rows(
+            Sale.item_api_id, item_api_ids,
+            Sale.item_api_id, Sale.name, Sale.sale_currency,
+            Sale.sale_amount, Sale.item_updated_at)
+        return dict((row.item_api_id, row) for row in rows)
+
+    def upsert_sales(self, rows):
+        self._upsert_rows(Sale, rows, key='item_api_id')
+
+    def items_with_mod(self, mod, minimum=None, maximum=None, active=True):
+        # mod may be a template or an example: '+90 to maximum Life'
+        template, _ = mod_template(mod)
+        query = self.session.query(Item)
+        query = query.join(ItemMod, ItemMod.item_id == Item.id)
+        query = query.join(Mod, Mod.id == ItemMod.mod_id)
+        query = query.filter(Mod.template == template)
+        if minimum is not None:
+            query = query.filter(ItemMod.value1 >= minimum)
+        if maximum is not None:
+            query = query.filter(ItemMod.value1 <= maximum)
+        if active:
+            query = query.filter(Item.active == True)
+        return query
+
+    def backfill_item_mods(self, block_size=1000):
+        columns = [
+            Item.id, Item.api_id, Item.explicitMods, Item.implicitMods,
+            Item.craftedMods, Item.enchantMods, Item.utilityMods,
+            Item.properties]
+        after = 0
+        total = 0
+        while True:
+            query = self.session.query(*columns)
+            query = query.filter(Item.id > after).order_by(Item.id)
+            rows = query.limit(block_size).all()
+            if not rows:
+                break
+            after = rows[-1].id
+            self._write_item_mods(
+                dict((row.api_id, row._asdict()) for row in rows))
+            self.session.commit()
+            total += len(rows)
+            self.logger.info("Normalized mods of %s items", total)
+
+    def get_checkpoint(self, name, leagues=None):
+        # A shard resumes from its furthest-behind league; a league with
+        # no checkpoint of its own uses the all-league one.
+        query = self.session.query(
+            Checkpoint.league, Checkpoint.item_updated_at, Checkpoint.item_id)
+        query = query.filter(Checkpoint.name == name)
+        positions = dict(
+            (row.league, (row.item_updated_at, row.item_id))
+            for row in query.all())
+        found = [
+            positions.get(league, positions.get(''))
+            for league in (leagues or [''])]
+        if None in found:
+            return None
+        return min(found)
+
+    def save_checkpoint(self, name, leagues, position):
+        now = int(time.time())
+        item_updated_at, item_id = position
+        for league in (leagues or ['']):
+            update = sqlalchemy.sql.expression.update(Checkpoint)
+            update = update.where(Checkpoint.name == name)
+            update = update.where(Checkpoint.league == league)
+            update = update.values(
+                item_updated_at=item_updated_at, item_id=item_id,
+                updated_at=now)
+            if self.session.execute(update).rowcount == 0:
+                self.session.execute(
+                    sqlalchemy.sql.expression.insert(Checkpoint),
+                    dict(name=name, league=league,
+                         item_updated_at=item_updated_at, item_id=item_id,
+                         updated_at=now))
+
+    def _items_written(self, updated_at):
+        if self._high_water is None or updated_at > self._high_water:
+            self._high_water = updated_at
+
+    def _publish_items(self, session):
+        # Only committed rows are visible to the postprocessor
+        if self.notifier is not None and self._high_water is not None:
+            self.notifier.publish(self._high_water)
+        self._high_water = None
+
+    def _forget_uncommitted(self, session):
+        self._high_water = None
+        # Mods inserted in the rolled back transaction are gone again
+        self._mod_id_cache = {}
+
+    @staticmethod
+    def _content_hash(values, extra=()):
+        content = json.dumps(
+            [value for field, value in values.items()
+             if field not in PoeDb.unhashed_fields] + list(extra))
+        return hashlib.blake2b(
+            content.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _stash_hash(self, values, items):
+        if items is None:
+            return self._content_hash(values)
+        return self._content_hash(
+            values, [api_id + row['content_hash'] for api_id, row in items])
+
+    def _simple_row(self, thing, read_fields, now):
+        row = read_fields(thing)
+        row['api_id'] = thing.id
+        row['created_at'] = now
+        row['updated_at'] = now
+        return row
 
-    def _insert_or_update_row(self, table, thing, simple_fields, stash=None):
+    def _lookup_ids(self, table, api_ids, key='api_id'):
+        key_field = getattr(table, key)
+        return dict(self._lookup_rows(key_field, api_ids, key_field, table.id))
+
+    def _lookup_rows(self, key_field, values, *columns):
+        values = list(values)
+        rows = []
+        for start in range(0, len(values), self.lookup_chunk):
+            chunk = values[start:start+self.lookup_chunk]
+            query = self.session.query(*columns)
+            query = query.filter(key_field.in_(chunk))
+            rows += query.all()
+        return rows
+
+    def _upsert_rows(self, table, rows, key='api_id', keep=('created_at',)):
+        if not rows:
+            return
+        dialect = self._engine.dialect.name
+        columns = [name for name in rows[0] if name != key and name not in keep]
+
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                cmd = sqlalchemy.dialects.sqlite.insert(table.__table__)
+            else:
+                cmd = sqlalchemy.dialects.postgresql.insert(table.__table__)
+            if columns:
+                cmd = cmd.on_conflict_do_update(
+                    index_elements=[key],
+                    set_=dict((name, cmd.excluded[name]) for name in columns))
+            else:
+                cmd = cmd.on_conflict_do_nothing(index_elements=[key])
+            self.session.execute(cmd, rows)
+        elif dialect == 'mysql':
+            cmd = sqlalchemy.dialects.mysql.insert(table.__table__)
+            if columns:
+                cmd = cmd.on_duplicate_key_update(
+                    **dict((name, cmd.inserted[name]) for name in columns))
+            else:
+                cmd = cmd.prefix_with('IGNORE')
+            self.session.execute(cmd, rows)
+        else:
+            # No native upsert, so split the batch on one IN lookup
+            existing = self._lookup_ids(
+                table, (row[key] for row in rows), key=key)
+            new_rows = [row for row in rows if row[key] not in existing]
+            old_rows = [
+                dict(((name, row[name]) for name in columns),
+                     id=existing[row[key]])
+                for row in rows if row[key] in existing]
+            if new_rows:
+                self.session.execute(
+                    sqlalchemy.sql.expression.insert(table.__table__),
+                    new_rows)
+            if old_rows and columns:
+                self.session.bulk_update_mappings(table, old_rows)
+
+    def _write_item_mods(self, item_rows):
+        if not item_rows:
+            return
+        item_ids = self._lookup_ids(Item, item_rows)
+        mods = [
+            (item_ids[api_id], mod)
+            for api_id, row in item_rows.items() for mod in item_mods(row)]
+        mod_ids = self._mod_ids(set(mod[1] for _, mod in mods))
+
+        ids = list(item_ids.values())
+        for start in range(0, len(ids), self.lookup_chunk):
+            delete = sqlalchemy.sql.expression.delete(ItemMod)
+            delete = delete.where(
+                ItemMod.item_id.in_(ids[start:start+self.lookup_chunk]))
+            self.session.execute(delete)
+        if mods:
+            self.session.execute(
+                sqlalchemy.sql.expression.insert(ItemMod.__table__), [
+                    {'item_id': item_id,
+                     'mod_id': mod_ids[template[:255]],
+                     'mod_type': mod_type,
+                     'value1': values[0] if values else None,
+                     'value2': values[1] if len(values) > 1 else None}
+                    for item_id, (mod_type, template, values) in mods])
+
+    def _mod_ids(self, templates):
+        templates = set(template[:255] for template in templates)
+        missing = templates.difference(self._mod_id_cache)
+        if missing:
+            self._mod_id_cache.update(
+                self._lookup_rows(Mod.template, missing, Mod.template, Mod.id))
+            missing.difference_update(self._mod_id_cache)
+        if missing:
+            now = int(time.time())
+            self._upsert_rows(
+                Mod, [{'template': template, 'created_at': now}
+                      for template in missing],
+                key='template')
+            self._mod_id_cache.update(
+                self._lookup_rows(Mod.template, missing, Mod.template, Mod.id))
+        return self._mod_id_cache
+
+    def _invalidate_stash_items(
+            self, stash_ids, item_ids=None, in_stashes=False):
+        stash_ids = list(stash_ids)
+        if item_ids is None:
+            update = sqlalchemy.sql.expression.update(Item)
+            update = update.where(Item.stash_id.in_(stash_ids))
+            update = update.values(active=False)
+            self.session.execute(update)
+            return
+        item_ids = list(item_ids)
+        for start in range(0, len(item_ids), self.lookup_chunk):
+            update = sqlalchemy.sql.expression.update(Item)
+            update = update.where(
+                Item.id.in_(item_ids[start:start+self.lookup_chunk]))
+            if in_stashes:
+                update = update.where(Item.stash_id.in_(stash_ids))
+            update = update.values(active=False)
+            self.session.execute(update)
+
+    def _insert_or_update_row(self, table, api_id, values, stash=None):
         now = int(time.time())
         query = self.session.query(table)
-        if thing.id:
-            existing = query.filter(table.api_id == thing.id).one_or_none()
+        if api_id:
+            existing = query.filter(table.api_id == api_id).one_or_none()
         else:
             existing = None
         if existing:
+            if (existing.content_hash == values['content_hash'] and
+                    (table != Item or (
+                        existing.active and existing.stash_id == stash.id))):
+                return (existing, False)
             row = existing
         else:
             row = table()
             row.created_at = now
 
-        row.api_id = thing.id
+        row.api_id = api_id
         row.updated_at = now
         if stash:
             row.stash_id = stash.id
         if table == Item:
             row.active = True
 
-        for field in simple_fields:
-            setattr(row, field, getattr(thing, field, None))
+        for field, value in values.items():
+            setattr(row, field, value)
 
         self.session.add(row)
-        return row
+        return (row, True)
 
     @property
     def session(self):
         if not self._session:
             self._session = self._session_maker()
+            sqlalchemy.event.listen(
+                self._session, 'after_commit', self._publish_items)
+            sqlalchemy.event.listen(
+                self._session, 'after_rollback', self._forget_uncommitted)
         return self._session
 
     def create_database(self):
         PoeDbBase.metadata.create_all(self._engine)
+        self.upgrade_database()
+
+    def upgrade_database(self):
+        self._add_missing_columns()
+        self._backfill_sale_leagues()
+        self._add_missing_indexes()
+
+    def _backfill_sale_leagues(self):
+        if not sqlalchemy.inspect(self._engine).has_table(Sale.__tablename__):
+            return
+        league = sqlalchemy.select(Item.league)
+        league = league.where(Item.id == Sale.item_id).scalar_subquery()
+        update = sqlalchemy.sql.expression.update(Sale)
+        update = update.where(Sale.league == None).values(league=league)
+        with self._engine.begin() as connection:
+            count = connection.execute(update).rowcount
+        if count:
+            self.logger.info("Backfilled league of %s sales", count)
+
+    def _add_missing_indexes(self):
+        inspector = sqlalchemy.inspect(self._engine)
+        for table in PoeDbBase.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            present = set(
+                index['name'] for index in inspector.get_indexes(table.name))
+            for index in table.indexes:
+                if index.name not in present:
+                    self.logger.info("Creating index %s", index.name)
+                    index.create(bind=self._engine)
+
+    def _add_missing_columns(self):
+        # create_all never alters existing tables, so nullable columns
+        # added since a database was created are added here.
+        inspector = sqlalchemy.inspect(self._engine)
+        quote = self._engine.dialect.identifier_preparer.quote
+        with self._engine.begin() as connection:
+            for table in PoeDbBase.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+                present = set(
+                    column['name']
+                    for column in inspector.get_columns(table.name))
+                for column in table.columns:
+                    if column.name in present or not column.nullable:
+                        continue
+                    connection.execute(sqlalchemy.text(
+                        "ALTER TABLE %s ADD COLUMN %s %s" % (
+                            quote(table.name), quote(column.name),
+                            column.type.compile(
+                                dialect=self._engine.dialect))))
+                    self.logger.info(
+                        "Added column %s.%s", table.name, column.name)
 
     def _safe_uri(self, uri):
         return self._safe_uri_re.sub('******', uri)
 
-    def __init__(self, db_connect=None, echo=False, logger=logging):
+    def __init__(
+            self, db_connect=None, echo=False, notifier=None,
+            normalize_mods=None, logger=logging):
         self.logger=logger
+        self.notifier = notifier
+        self._high_water = None
+        self._mod_id_cache = {}
+        if normalize_mods is not None:
+            self.normalize_mods = normalize_mods
 
         if db_connect is not None:
             self.logger.debug("Connect URI: %s", self._safe_uri(db_connect))
@@ -0,0 +1,186 @@
+import os
+import time
+import logging
+import collections
+import urllib.parse
+
+import numpy
+import sqlalchemy
+import pyarrow
+import pyarrow.dataset
+import pyarrow.parquet
+
+from .database import Item, Sale, CurrencySummary, SemiJSON, COMMIT_LAG
+
+
+ExportSpec = collections.namedtuple(
+    'ExportSpec', 'name model watermark day league')
+
+EXPORT_SPECS = dict((spec.name, spec) for spec in (
+    ExportSpec('item', Item, Item.updated_at, Item.updated_at, Item.league),
+    ExportSpec('sale', Sale, Sale.updated_at, Sale.item_updated_at, Sale.league),
+    ExportSpec(
+        'currency_summary', CurrencySummary, CurrencySummary.updated_at,
+        CurrencySummary.updated_at, CurrencySummary.league)))
+
+PARTITIONING = pyarrow.dataset.partitioning(
+    pyarrow.schema([('league', pyarrow.string()), ('day', pyarrow.string())]),
+    flavor='hive')
+
+
+def _arrow_type(column_type):
+    if isinstance(column_type, sqlalchemy.Boolean):
+        return pyarrow.bool_()
+    if isinstance(column_type, sqlalchemy.Integer):
+        return pyarrow.int64()
+    if isinstance(column_type, sqlalchemy.Float):
+        return pyarrow.float64()
+    return pyarrow.string()
+
+
+def _day(timestamp):
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+
+class ColumnarExporter:
+
+    block_size = 50000
+    tables = ('item', 'sale', 'currency_summary')
+    watermark_name = '_watermark'
+    commit_lag = COMMIT_LAG
+
+    def __init__(
+            self, db, directory, tables=None, block_size=None, logger=logging):
+        self.db = db
+        self.directory = directory
+        self.logger = logger
+        if tables is not None:
+            self.tables = tables
+        if block_size is not None:
+            self.block_size = block_size
+
+    def export(self):
+        for name in self.tables:
+            self.export_table(EXPORT_SPECS[name])
+
+    def export_table(self, spec):
+        # JSON blobs stay in the database; mods are in item_mod
+        columns = [
+            column for column in spec.model.__table__.columns
+            if not isinstance(column.type, SemiJSON)]
+        if spec.league.table is not spec.model.__table__:
+            columns.append(spec.league.label('league'))
+        schema = pyarrow.schema([
+            (column.name, _arrow_type(column.type)) for column in columns
+            if column.name != 'league'])
+
+        position = self.read_watermark(spec.name)
+        # A row can commit after rows stamped later than it have been
+        # exported, so each run rereads commit_lag seconds behind the
+        # watermark. Rows exported twice are dropped by
+        # load_table(latest=True).
+        cursor = None
+        if position is not None:
+            cursor = (position[0] - self.commit_lag, 0)
+        total = 0
+        while True:
+            rows = self._block(spec, columns, cursor)
+            if not rows:
+                break
+            self._write_block(spec, schema, rows)
+            last = rows[-1]
+            cursor = (getattr(last, spec.watermark.name), last.id)
+            position = max(position, cursor) if position else cursor
+            # Files are named after their block, so a crash before this
+            # point just rewrites them on the next run.
+            self.write_watermark(spec.name, position)
+            total += len(rows)
+            self.logger.info("Exported %s %s rows", total, spec.name)
+        return total
+
+    def read_watermark(self, name):
+        path = os.path.join(self.directory, name, self.watermark_name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as watermark_file:
+            updated_at, row_id = watermark_file.read().split()
+        return (int(updated_at), int(row_id))
+
+    def write_watermark(self, name, position):
+        path = os.path.join(self.directory, name, self.watermark_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as watermark_file:
+            watermark_file.write("%s %s\n" % position)
+        os.replace(path + '.tmp', path)
+
+    def _block(self, spec, columns, position):
+        model = spec.model
+        query = self.db.session.query(*columns)
+        if spec.league.table is not model.__table__:
+            query = query.join(Item, model.item_id == Item.id)
+        if position is not None:
+            updated_at, row_id = position
+            query = query.filter(sqlalchemy.or_(
+                spec.watermark > updated_at,
+                sqlalchemy.and_(
+                    spec.watermark == updated_at, model.id > row_id)))
+        query = query.order_by(spec.watermark, model.id)
+        rows = query.limit(self.block_size).all()
+        self.db.session.rollback()
+        return rows
+
+    def _write_block(self, spec, schema, rows):
+        partitions = collections.defaultdict(list)
+        for row in rows:
+            partitions[(row.league, _day(getattr(row, spec.day.name)))].append(
+                row)
+        first = rows[0]
+        part_name = 'part-%s-%s.parquet' % (
+            getattr(first, spec.watermark.name), first.id)
+        for (league, day), part_rows in partitions.items():
+            path = os.path.join(
+                self.directory, spec.name,
+                'league=%s' % urllib.parse.quote(league, safe=''),
+                'day=%s' % day)
+            os.makedirs(path, exist_ok=True)
+            table = pyarrow.table(
+                dict((field.name, [getattr(row, field.name) for row in part_rows])
+                     for field in schema),
+                schema=schema)
+            pyarrow.parquet.write_table(table, os.path.join(path, part_name))
+
+
+def load_table(
+        directory, name, league=None, start=None, end=None, columns=None,
+        latest=False):
+    # start and end are 'YYYY-MM-DD' days, both inclusive
+    dataset = pyarrow.dataset.dataset(
+        os.path.join(directory, name), format='parquet',
+        partitioning=PARTITIONING)
+    conditions = []
+    if league is not None:
+        conditions.append(pyarrow.dataset.field('league') == league)
+    if start is not None:
+        conditions.append(pyarrow.dataset.field('day') >= start)
+    if end is not None:
+        conditions.append(pyarrow.dataset.field('day') <= end)
+    condition = None
+    for part in conditions:
+        condition = part if condition is None else condition & part
+    if latest and columns is not None:
+        columns = list(columns) + [
+            extra for extra in ('id', 'updated_at') if extra not in columns]
+    table = dataset.to_table(columns=columns, filter=condition)
+    if latest:
+        # Rows are exported again whenever they change, and rows near the
+        # watermark on every run; keep the newest
+        table = table.sort_by([('id', 'ascending'), ('updated_at', 'descending')])
+        ids = table.column('id').to_numpy()
+        if len(ids):
+            table = table.take(
+                numpy.flatnonzero(numpy.r_[True, ids[1:] != ids[:-1]]))
+    return table
+
+
+def load_frame(directory, name, **kwargs):
+    return load_table(directory, name, **kwargs).to_pandas()
\ No newline at end of file
@@ -0,0 +1,32 @@
+import re
+
+
+MOD_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+
+MOD_FIELDS = (
+    ('explicitMods', 'explicit'),
+    ('implicitMods', 'implicit'),
+    ('craftedMods', 'crafted'),
+    ('enchantMods', 'enchant'),
+    ('utilityMods', 'utility'))
+
+
+def mod_template(text):
+    # '+90 to maximum Life' -> ('+# to maximum Life', [90.0])
+    values = [float(number) for number in MOD_NUMBER_RE.findall(text)]
+    return (MOD_NUMBER_RE.sub('#', text), values)
+
+
+def property_text(prop):
+    values = [value[0] for value in prop.get('values') or () if value]
+    if not values:
+        return prop.get('name') or ''
+    return "%s: %s" % (prop.get('name') or '', ", ".join(values))
+
+
+def item_mods(row):
+    for field, mod_type in MOD_FIELDS:
+        for text in row.get(field) or ():
+            yield (mod_type,) + mod_template(text)
+    for prop in row.get('properties') or ():
+        yield ('property',) + mod_template(property_text(prop))
\ No newline at end of file
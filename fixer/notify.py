@@ -0,0 +1,81 @@
+import select
+import logging
+import threading
+
+import sqlalchemy
+
+
+class LocalNotifier:
+
+    def __init__(self, logger=logging):
+        self.logger = logger
+        self.mark = None
+        self._version = 0
+        self._seen = 0
+        self._condition = threading.Condition()
+
+    def listen(self):
+        pass
+
+    def publish(self, mark):
+        with self._condition:
+            if self.mark is None or mark > self.mark:
+                self.mark = mark
+            self._version += 1
+            self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._version != self._seen, timeout)
+            if self._version == self._seen:
+                return None
+            self._seen = self._version
+            return self.mark
+
+
+class PostgresNotifier:
+
+    channel = 'poefixer_items'
+
+    def __init__(self, engine, channel=None, logger=logging):
+        self.engine = engine
+        self.logger = logger
+        if channel is not None:
+            self.channel = channel
+        self._listener = None
+
+    def listen(self):
+        if self._listener is not None:
+            return
+        # NOTIFY is only delivered to a connection outside a transaction
+        self._listener = self.engine.raw_connection()
+        self._listener.driver_connection.autocommit = True
+        cursor = self._listener.cursor()
+        cursor.execute('LISTEN "%s"' % self.channel)
+        cursor.close()
+        self.logger.debug("Listening for ingest on %s", self.channel)
+
+    def publish(self, mark):
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            conn.execute(
+                sqlalchemy.text('SELECT pg_notify(:channel, :mark)'),
+                {'channel': self.channel, 'mark': str(mark)})
+
+    def wait(self, timeout=None):
+        self.listen()
+        connection = self._listener.driver_connection
+        if not connection.notifies:
+            if not select.select([connection], [], [], timeout)[0]:
+                return None
+            connection.poll()
+        marks = [int(notify.payload) for notify in connection.notifies]
+        del connection.notifies[:]
+        return max(marks) if marks else None
+
+
+def database_notifier(db, logger=logging):
+    if db._engine.dialect.name == 'postgresql':
+        return PostgresNotifier(db._engine, logger=logger)
+    return None
\ No newline at end of file
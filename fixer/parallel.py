@@ -0,0 +1,211 @@
+import time
+import zlib
+import queue
+import signal
+import logging
+import collections
+import multiprocessing
+
+import sqlalchemy
+
+from .logger import get_poefixer_logger
+from .database import PoeDb, COMMIT_LAG
+from .notify import database_notifier
+
+
+def stash_partition(stash, partitions):
+    # Items move between the stashes of one account, so an account's
+    # stashes share a worker and its moves are applied in page order.
+    # crc32 rather than hash() so every process agrees on the owner.
+    key = stash.accountName or stash.id
+    return zlib.crc32(key.encode('utf-8')) % partitions
+
+
+def _ingest_worker(
+        number, db_connect, tasks, results, with_items, batch_size,
+        idle_commit, max_transaction_age, normalize_mods, log_level):
+    # Ctrl-C reaches the whole process group; the coordinator drains
+    # the queues and then stops the workers itself.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logger = get_poefixer_logger(log_level)
+    db = PoeDb(
+        db_connect=db_connect, normalize_mods=normalize_mods, logger=logger)
+    db.notifier = database_notifier(db, logger=logger)
+    pending = 0
+    page = None
+    opened = None
+    while True:
+        # Rows are stamped when written, so a transaction must not stay
+        # open across a quiet river, or for longer than readers allow
+        # for with COMMIT_LAG
+        try:
+            task = tasks.get(timeout=idle_commit)
+        except queue.Empty:
+            task = False
+        if task is None:
+            break
+        if task:
+            page, stashes = task
+            if opened is None:
+                opened = time.monotonic()
+            db.insert_api_stashes(stashes, with_items=with_items)
+            pending += len(stashes)
+        if pending and (
+                not task or pending >= batch_size or
+                time.monotonic() - opened >= max_transaction_age):
+            db.session.commit()
+            opened = None
+            # Every page this worker was sent up to here is now stored
+            results.put((number, page))
+            logger.debug("Worker %s committed %s stashes", number, pending)
+            pending = 0
+    db.session.commit()
+    if pending:
+        results.put((number, page))
+    logger.info("Ingest worker %s finished", number)
+
+
+class ParallelIngest:
+
+    workers = 4
+    batch_size = 500
+    queue_size = 4
+    poll_interval = 0.5
+    # Seconds a worker waits for more stashes before committing
+    idle_commit = 1
+    # Longest a worker keeps a transaction open, well inside COMMIT_LAG
+    max_transaction_age = COMMIT_LAG / 6
+
+    def __init__(
+            self, api, db_connect,
+            workers=None, batch_size=None, with_items=True,
+            normalize_mods=False, log_level=logging.INFO, logger=logging):
+        self.api = api
+        self.db_connect = db_connect
+        self.with_items = with_items
+        self.normalize_mods = normalize_mods
+        self.log_level = log_level
+        self.logger = logger
+        if workers is not None:
+            self.workers = workers
+        if batch_size is not None:
+            self.batch_size = batch_size
+        url = sqlalchemy.engine.make_url(db_connect)
+        if self.workers > 1 and url.get_backend_name() == 'sqlite':
+            # SQLite takes one writer at a time, and a worker waiting on
+            # another's transaction fails with "database is locked"
+            raise ValueError(
+                "A SQLite database cannot be written by %s ingest workers"
+                % self.workers)
+        self.pages_done = 0
+        # Change id following the last page every worker has committed
+        self.next_id = api.next_id
+        # Change id following each page not yet committed by all workers
+        self.page_ids = {}
+        # Per worker, the pages it was sent that it has not committed
+        self.uncommitted = []
+
+    def run(self, max_pages=None):
+        # spawn, so no worker inherits the coordinator's connections
+        context = multiprocessing.get_context('spawn')
+        tasks = [
+            context.Queue(maxsize=self.queue_size)
+            for _ in range(self.workers)]
+        results = context.Queue()
+        self.uncommitted = [
+            collections.deque() for _ in range(self.workers)]
+        processes = [
+            context.Process(
+                target=_ingest_worker,
+                name='poefixer-ingest-%s' % number,
+                args=(
+                    number, self.db_connect, tasks[number], results,
+                    self.with_items, self.batch_size, self.idle_commit,
+                    self.max_transaction_age, self.normalize_mods,
+                    self.log_level))
+            for number in range(self.workers)]
+        for process in processes:
+            process.start()
+
+        try:
+            while max_pages is None or self.pages_done < max_pages:
+                try:
+                    stashes = self.api.get_next()
+                except EOFError as e:
+                    self.logger.info("Ingest source exhausted: %s", e)
+                    break
+                partitions = [[] for _ in range(self.workers)]
+                for stash in stashes:
+                    partitions[stash_partition(stash, self.workers)].append(
+                        stash)
+                page = self.pages_done + 1
+                self.page_ids[page] = self.api.next_id
+                for number, partition in enumerate(partitions):
+                    if partition:
+                        self._put(
+                            processes[number], tasks[number],
+                            (page, partition))
+                        self.uncommitted[number].append(page)
+                self.pages_done = page
+                self._collect(results)
+                self.logger.info("Stash page %s dispatched.", self.pages_done)
+        except KeyboardInterrupt:
+            self.logger.info("Stopping ingest, draining worker queues...")
+        finally:
+            for number, process in enumerate(processes):
+                try:
+                    self._put(process, tasks[number], None)
+                except RuntimeError:
+                    # Reported with the other failed workers below
+                    pass
+            for process in processes:
+                # Acknowledgements are read while waiting, so no worker
+                # blocks on a full results pipe
+                while process.is_alive():
+                    self._collect(results, self.poll_interval)
+                process.join()
+            self._collect(results)
+            # Pages are dispatched ahead of their commits; resume from the
+            # last page every worker actually committed
+            self.api.next_id = self.next_id
+            self.logger.info(
+                "Ingest stopped before change id %s", self.next_id)
+
+        failed = [
+            process.name for process in processes if process.exitcode != 0]
+        if failed:
+            raise RuntimeError("Ingest workers failed: %s" % ", ".join(failed))
+
+    def _collect(self, results, timeout=None):
+        while True:
+            try:
+                if timeout is None:
+                    number, page = results.get_nowait()
+                else:
+                    number, page = results.get(timeout=timeout)
+                    timeout = None
+            except queue.Empty:
+                break
+            uncommitted = self.uncommitted[number]
+            while uncommitted and uncommitted[0] <= page:
+                uncommitted.popleft()
+        # Every page before the oldest uncommitted one is fully stored
+        committed = min(
+            [uncommitted[0] - 1 for uncommitted in self.uncommitted
+             if uncommitted] + [self.pages_done])
+        for page in list(self.page_ids):
+            if page > committed:
+                break
+            self.next_id = self.page_ids.pop(page)
+
+    def _put(self, process, target, value):
+        while True:
+            if not process.is_alive():
+                raise RuntimeError(
+                    "Ingest worker %s exited with %s" % (
+                        process.name, process.exitcode))
+            try:
+                target.put(value, timeout=self.poll_interval)
+                return
+            except queue.Full:
+                continue
\ No newline at end of file
@@ -0,0 +1,131 @@
+import queue
+import logging
+import threading
+
+
+_DONE = object()
+
+
+class IngestPipeline:
+
+    queue_size = 2
+    poll_interval = 0.1
+
+    def __init__(
+            self, api, db, with_items=True, queue_size=None, logger=logging):
+        self.api = api
+        self.db = db
+        self.with_items = with_items
+        self.logger = logger
+        if queue_size is not None:
+            self.queue_size = queue_size
+        self.responses = queue.Queue(maxsize=self.queue_size)
+        self.pages = queue.Queue(maxsize=self.queue_size)
+        self.stopping = threading.Event()
+        self.aborted = threading.Event()
+        self.error = None
+        self.pages_done = 0
+        # Change id following the last committed page, and the page
+        # being persisted, if any
+        self.next_id = api.next_id
+        self.current = None
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self, max_pages=None):
+        # Persisting stays on the calling thread, which owns the session
+        threads = [
+            threading.Thread(
+                target=self._stage, name='poefixer-fetch',
+                args=(self._fetch_stage, max_pages)),
+            threading.Thread(
+                target=self._stage, name='poefixer-decode',
+                args=(self._decode_stage,))]
+        for thread in threads:
+            thread.start()
+        try:
+            self._stage(self._persist_stage)
+        except KeyboardInterrupt:
+            self.logger.info("Stopping ingest, draining queued pages...")
+            # The interrupted page is retried from self.current
+            self.db.session.rollback()
+            self.stop()
+            self._stage(self._persist_stage)
+        finally:
+            for thread in threads:
+                thread.join()
+            # Fetching runs ahead of persisting; after a failure, resume
+            # from the last page that actually committed
+            self.api.next_id = self.next_id
+            self.logger.info(
+                "Ingest stopped before change id %s", self.next_id)
+        if self.error is not None:
+            raise self.error
+
+    def _stage(self, stage, *args):
+        try:
+            stage(*args)
+        except Exception as e:
+            self.logger.exception("Ingest stage failed: %s", e)
+            self.error = e
+            self.aborted.set()
+
+    def _put(self, target, value):
+        while not self.aborted.is_set():
+            try:
+                target.put(value, timeout=self.poll_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source):
+        while not self.aborted.is_set():
+            try:
+                return source.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fetch_stage(self, max_pages):
+        fetched = 0
+        while not self.stopping.is_set():
+            if max_pages is not None and fetched >= max_pages:
+                break
+            try:
+                response = self.api.fetch_next()
+            except EOFError as e:
+                self.logger.info("Ingest source exhausted: %s", e)
+                break
+            if not self._put(self.responses, response):
+                return
+            fetched += 1
+        self._put(self.responses, _DONE)
+
+    def _decode_stage(self):
+        while True:
+            response = self._get(self.responses)
+            if response is _DONE:
+                break
+            stashes = list(self.api.decode_next(response))
+            if not self._put(
+                    self.pages, (response.next_change_id, stashes)):
+                return
+        self._put(self.pages, _DONE)
+
+    def _persist_stage(self):
+        while True:
+            if self.current is None:
+                page = self._get(self.pages)
+                if page is _DONE:
+                    break
+                self.current = page
+            next_id, stashes = self.current
+            self.logger.debug("Inserting stash page...")
+            self.db.insert_api_stashes(stashes, with_items=self.with_items)
+            self.db.session.commit()
+            self.current = None
+            self.next_id = next_id
+            self.pages_done += 1
+            self.logger.info("Stash pass complete.")
\ No newline at end of file
@@ -0,0 +1,259 @@
+import heapq
+import logging
+import collections
+
+import fixer
+
+
+CHAOS = 'Chaos Orb'
+
+CurrencyEdge = collections.namedtuple('CurrencyEdge', 'mean weight')
+
+
+class ConversionPaths:
+
+    __slots__ = ('width', 'rate', 'next', 'hops', 'children')
+
+    def __init__(self):
+        self.width = {CHAOS: float('inf')}
+        self.rate = {CHAOS: 1.0}
+        self.next = {}
+        self.hops = {CHAOS: 0}
+        # Nodes routing through each node, so a change can be pushed to
+        # just the routes it affects
+        self.children = {}
+
+    def route(self, node, target, width, mean):
+        old = self.next.get(node)
+        if old != target:
+            if old is not None:
+                self.children[old].discard(node)
+            self.children.setdefault(target, set()).add(node)
+            self.next[node] = target
+        self.width[node] = width
+        self.rate[node] = mean * self.rate[target]
+        self.hops[node] = self.hops[target] + 1
+
+
+class CurrencyGraph:
+
+    def __init__(self, logger=logging):
+        self.logger = logger
+        self.leagues = {}
+        self.reverse = {}
+        self.paths = {}
+        self.fallback_paths = {}
+
+    def load(self, session, leagues=None):
+        self.leagues = {}
+        self.reverse = {}
+        self.paths = {}
+        self.fallback_paths = {}
+        query = session.query(
+            fixer.CurrencySummary.from_currency,
+            fixer.CurrencySummary.to_currency,
+            fixer.CurrencySummary.league,
+            fixer.CurrencySummary.mean,
+            fixer.CurrencySummary.weight)
+        if leagues:
+            query = query.filter(fixer.CurrencySummary.league.in_(leagues))
+        count = 0
+        for row in query.all():
+            self._set_edge(
+                row.from_currency, row.to_currency, row.league,
+                CurrencyEdge(row.mean, row.weight))
+            count += 1
+        self.logger.debug("Loaded %s currency summaries", count)
+
+    def update(self, from_currency, to_currency, league, mean, weight):
+        edge = CurrencyEdge(mean, weight)
+        old = self._set_edge(from_currency, to_currency, league, edge)
+        if old == edge:
+            return
+        paths = self.paths.get(league)
+        if paths is not None and not self._update_paths(
+                paths, [(from_currency, to_currency)],
+                self._forward_sources(league), self._forward_link(league)):
+            del self.paths[league]
+        # The summary is also an inverted edge in the fallback paths
+        paths = self.fallback_paths.get(league)
+        if paths is not None and not self._update_paths(
+                paths,
+                [(from_currency, to_currency), (to_currency, from_currency)],
+                self._all_sources(league), self._all_link(league)):
+            del self.fallback_paths[league]
+
+    def edge(self, from_currency, to_currency, league):
+        return self.leagues.get(league, {}).get(
+            from_currency, {}).get(to_currency)
+
+    def find_rate(self, name, league):
+        if name == CHAOS:
+            return 1.0
+        rate = self._league_paths(league).rate.get(name)
+        if rate is None:
+            rate = self._league_fallback_paths(league).rate.get(name)
+            if rate is not None:
+                self.logger.debug(
+                    "Falling back on inverted pricing for %s: %s", name, rate)
+        return rate
+
+    def path(self, name, league):
+        paths = self._league_paths(league)
+        if name not in paths.rate:
+            paths = self._league_fallback_paths(league)
+        if name not in paths.rate:
+            return None
+        route = [name]
+        while route[-1] != CHAOS:
+            route.append(paths.next[route[-1]])
+        return route
+
+    def _set_edge(self, from_currency, to_currency, league, edge):
+        edges = self.leagues.setdefault(league, {}).setdefault(
+            from_currency, {})
+        old = edges.get(to_currency)
+        edges[to_currency] = edge
+        self.reverse.setdefault(league, {}).setdefault(
+            to_currency, {})[from_currency] = edge
+        return old
+
+    def _league_paths(self, league):
+        paths = self.paths.get(league)
+        if paths is None:
+            paths = ConversionPaths()
+            self._relax(
+                paths, [CHAOS], self._forward_sources(league))
+            self.paths[league] = paths
+        return paths
+
+    def _league_fallback_paths(self, league):
+        paths = self.fallback_paths.get(league)
+        if paths is None:
+            paths = ConversionPaths()
+            self._relax(
+                paths, [CHAOS], self._all_sources(league))
+            self.fallback_paths[league] = paths
+        return paths
+
+    def _forward_sources(self, league):
+        reverse = self.reverse.get(league, {})
+
+        def sources(target):
+            for source, edge in reverse.get(target, {}).items():
+                yield (source, edge.weight, edge.mean)
+        return sources
+
+    def _all_sources(self, league):
+        forward = self._forward_sources(league)
+        edges = self.leagues.get(league, {})
+
+        def sources(target):
+            yield from forward(target)
+            for source, edge in edges.get(target, {}).items():
+                if edge.mean:
+                    yield (source, edge.weight, 1.0/edge.mean)
+        return sources
+
+    def _forward_link(self, league):
+        edges = self.leagues.get(league, {})
+
+        def link(source, target, target_width):
+            # (width, mean) of source's route through target, if any
+            edge = edges.get(source, {}).get(target)
+            if edge is None:
+                return None
+            return (min(edge.weight, target_width), edge.mean)
+        return link
+
+    def _all_link(self, league):
+        forward = self._forward_link(league)
+        edges = self.leagues.get(league, {})
+
+        def link(source, target, target_width):
+            # The wider of the forward and inverted edge, the forward one
+            # at equal width, as _relax picks between them
+            best = forward(source, target, target_width)
+            edge = edges.get(target, {}).get(source)
+            if edge is not None and edge.mean:
+                width = min(edge.weight, target_width)
+                if best is None or width > best[0]:
+                    best = (width, 1.0/edge.mean)
+            return best
+        return link
+
+    @staticmethod
+    def _relax(paths, seeds, sources):
+        # Widest-path Dijkstra towards Chaos: a path scores the minimum
+        # weight along it. Only strictly wider paths replace a route, so
+        # at equal width the first one found, the one with fewer hops, wins.
+        width, hops = paths.width, paths.hops
+        heap = [(-width[node], hops[node], node) for node in seeds]
+        heapq.heapify(heap)
+        while heap:
+            neg_width, node_hops, node = heapq.heappop(heap)
+            if -neg_width != width[node]:
+                continue
+            for source, weight, mean in sources(node):
+                if source == CHAOS:
+                    continue
+                candidate = min(weight, -neg_width)
+                current = width.get(source)
+                if current is None or candidate > current:
+                    paths.route(source, node, candidate, mean)
+                    heapq.heappush(heap, (-candidate, node_hops + 1, source))
+
+    def _update_paths(self, paths, changed, sources, link):
+        # Applies changed (source, target) links to paths, touching only
+        # the routes through them. Returns False when a chosen route got
+        # narrower, which needs a full recompute.
+        changed = [
+            (source, target) for source, target in changed
+            if source != CHAOS and target in paths.width]
+        on_route = []
+        for source, target in changed:
+            if paths.next.get(source) != target:
+                continue
+            found = link(source, target, paths.width[target])
+            if found is None or found[0] < paths.width[source]:
+                return False
+            on_route.append(source)
+
+        # The chosen routes through an edge that got no worse are still
+        # the widest; other nodes may now prefer them too.
+        roots = list(on_route)
+        widened = self._resweep(paths, roots, link)
+        for source, target in changed:
+            if paths.next.get(source) == target:
+                continue
+            found = link(source, target, paths.width[target])
+            if found is None:
+                continue
+            current = paths.width.get(source)
+            if current is not None and found[0] <= current:
+                continue
+            paths.route(source, target, *found)
+            roots.append(source)
+            widened.append(source)
+        if widened:
+            self._relax(paths, widened, sources)
+            # Routes that only got a new rate, not a wider one
+            self._resweep(paths, roots, link)
+        return True
+
+    @staticmethod
+    def _resweep(paths, roots, link):
+        # Re-derive widths, rates and hops along the chosen routes through
+        # each root, each node after the one it routes through.
+        widened = []
+        for root in roots:
+            stack = [root]
+            while stack:
+                node = stack.pop()
+                target = paths.next[node]
+                width, mean = link(node, target, paths.width[target])
+                if width > paths.width[node]:
+                    widened.append(node)
+                paths.route(node, target, width, mean)
+                stack.extend(paths.children.get(node, ()))
+        return widened
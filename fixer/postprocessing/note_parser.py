@@ -0,0 +1,77 @@
+import logging
+
+from .currency_abbreviations import \
+    PRICE_RE, PRICE_WITH_SPACE_RE, \
+    OFFICIAL_CURRENCIES, UNOFFICIAL_CURRENCIES
+
+
+class NoteParser:
+
+    memo_size = 100000
+
+    def __init__(self, actual_currencies=None, memo_size=None, logger=logging):
+        self.logger = logger
+        if memo_size is not None:
+            self.memo_size = memo_size
+        self.actual_currencies = None
+        self.set_actual_currencies(actual_currencies or {})
+
+    def set_actual_currencies(self, actual_currencies):
+        if actual_currencies == self.actual_currencies:
+            return
+        self.actual_currencies = dict(actual_currencies)
+        # Later updates win: official, then unofficial, then the names
+        # seen in currency summaries.
+        self.currencies = dict(self.actual_currencies)
+        self.currencies.update(UNOFFICIAL_CURRENCIES)
+        self.currencies.update(OFFICIAL_CURRENCIES)
+        self._reset_memo()
+
+    def parse(self, note):
+        result = self.memo.get(note)
+        if result is None:
+            if len(self.memo) >= self.memo_size:
+                self._reset_memo()
+            result = self.memo[note] = self._parse(note)
+        return result
+
+    def parse_many(self, notes):
+        notes = list(notes)
+        memo = self.memo
+        missing = set(notes).difference(memo)
+        if len(memo) + len(missing) > self.memo_size:
+            self._reset_memo()
+            memo = self.memo
+            missing = set(notes).difference(memo)
+        for note in missing:
+            memo[note] = self._parse(note)
+        return [memo[note] for note in notes]
+
+    def _reset_memo(self):
+        self.memo = {None: (None, None)}
+
+    def _parse(self, note):
+        for regex in (PRICE_RE, PRICE_WITH_SPACE_RE):
+            match = regex.search(note)
+            if not match:
+                break
+            (sale_type, amt, currency) = match.groups()
+            try:
+                if '/' in amt:
+                    num, den = amt.split('/', 1)
+                    amt = float(num) / float(den)
+                else:
+                    amt = float(amt)
+            except ValueError as e:
+                if 'float' in str(e):
+                    self.logger.debug("Invalid price: %r" % note)
+                    break
+                raise
+            full_name = self.currencies.get(currency.lower())
+            if full_name is not None:
+                return (amt, full_name)
+        else:
+            self.logger.warning(
+                "Currency note: %r has unknown currency abbrev %s",
+                note, currency)
+        return (None, None)
\ No newline at end of file
@@ -0,0 +1,138 @@
+import time
+import logging
+import multiprocessing
+
+import sqlalchemy
+
+import fixer
+from fixer.logger import get_poefixer_logger
+from .processor import CurrencyPostprocessor
+
+
+def league_partition(league_sizes, partitions):
+    # Largest league first onto the least loaded worker
+    shards = [[] for _ in range(min(partitions, len(league_sizes)))]
+    loads = [0] * len(shards)
+    for league, size in sorted(
+            league_sizes.items(), key=lambda pair: (-pair[1], pair[0])):
+        target = loads.index(min(loads))
+        shards[target].append(league)
+        loads[target] += size
+    return shards
+
+
+def _postprocess_worker(
+        number, db_connect, leagues, start_time, options, log_level):
+    logger = get_poefixer_logger(log_level)
+    db = fixer.PoeDb(db_connect=db_connect, logger=logger)
+    logger.info(
+        "Postprocess worker %s handling %s", number, ", ".join(leagues))
+    # The coordinator has already prepared the schema
+    processor = CurrencyPostprocessor(
+        db, start_time, leagues=leagues,
+        notifier=fixer.database_notifier(db, logger=logger),
+        prepare=False, logger=logger, **options)
+    try:
+        processor.do_currency_postprocessor()
+    except KeyboardInterrupt:
+        logger.info("Postprocess worker %s interrupted", number)
+        return
+    logger.info("Postprocess worker %s finished", number)
+
+
+class ParallelPostprocessor:
+
+    workers = 4
+    discover_interval = 60
+
+    def __init__(
+            self, db_connect, start_time=None,
+            workers=None,
+            continuous=False,
+            recent=600,
+            limit=None,
+            block_size=None,
+            log_level=logging.INFO,
+            logger=logging):
+        self.db_connect = db_connect
+        self.start_time = start_time
+        self.continuous = continuous
+        self.options = dict(
+            continuous=continuous, recent=recent, limit=limit,
+            block_size=block_size)
+        self.log_level = log_level
+        self.logger = logger
+        if workers is not None:
+            self.workers = workers
+        self.processes = []
+        self.assigned = set()
+
+    def discover_leagues(self, db):
+        query = db.session.query(
+            fixer.Item.league, sqlalchemy.func.count(fixer.Item.id))
+        query = query.group_by(fixer.Item.league)
+        return dict(query.all())
+
+    def run(self):
+        db = fixer.PoeDb(db_connect=self.db_connect, logger=self.logger)
+        # Schema changes happen once here rather than racing in workers
+        CurrencyPostprocessor(db, None, logger=self.logger).prepare_database()
+        db.session.commit()
+
+        # spawn, so no worker inherits the coordinator's connections
+        context = multiprocessing.get_context('spawn')
+        try:
+            self._start(context, db, self.workers)
+            while self.continuous:
+                self._wait(self.discover_interval)
+                self._start(context, db, 1)
+            self._wait(None)
+        except KeyboardInterrupt:
+            self.logger.info("Stopping postprocess workers...")
+            for process in self.processes:
+                process.join()
+        except Exception:
+            for process in self.processes:
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            raise
+        finally:
+            db.session.close()
+
+    def _start(self, context, db, workers):
+        sizes = self.discover_leagues(db)
+        db.session.rollback()
+        new_leagues = dict(
+            (league, size) for league, size in sizes.items()
+            if league not in self.assigned)
+        if not new_leagues:
+            return
+        for leagues in league_partition(new_leagues, workers):
+            number = len(self.processes)
+            process = context.Process(
+                target=_postprocess_worker,
+                name='poefixer-postprocess-%s' % number,
+                args=(
+                    number, self.db_connect, leagues, self.start_time,
+                    self.options, self.log_level))
+            process.start()
+            self.processes.append(process)
+            self.assigned.update(leagues)
+            self.logger.info(
+                "Started postprocess worker %s for %s",
+                number, ", ".join(leagues))
+
+    def _wait(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        for process in self.processes:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.time())
+            process.join(remaining)
+        failed = [
+            process.name for process in self.processes
+            if not process.is_alive() and process.exitcode != 0]
+        if failed:
+            raise RuntimeError(
+                "Postprocess workers failed: %s" % ", ".join(failed))
\ No newline at end of file
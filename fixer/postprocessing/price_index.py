@@ -0,0 +1,181 @@
+import time
+import logging
+import datetime
+import threading
+import collections
+
+import sqlalchemy
+
+import fixer
+from .currency_graph import CurrencyGraph, CHAOS
+
+
+SaleAggregate = collections.namedtuple(
+    'SaleAggregate', 'count mean low high last_sale')
+
+
+class PriceIndex:
+
+    # Non-currency items are priced from their sales in this window
+    sale_window = int(datetime.timedelta(days=1).total_seconds())
+    # Each refresh rereads this much before its watermark
+    overlap = fixer.COMMIT_LAG
+    # Aggregates of items that stopped selling only age out on a reload
+    reload_interval = 3600
+    lookup_chunk = 500
+
+    def __init__(
+            self, db, sale_window=None, reload_interval=None, logger=logging):
+        self.db = db
+        self.logger = logger
+        if sale_window is not None:
+            self.sale_window = sale_window
+        if reload_interval is not None:
+            self.reload_interval = reload_interval
+        self.graph = CurrencyGraph(logger=logger)
+        self.sales = {}
+        self.summary_mark = None
+        self.sale_mark = None
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self, now=None):
+        now = int(time.time()) if now is None else now
+        if self.loaded_at is None or now - self.loaded_at >= self.reload_interval:
+            self.reload(now)
+            return
+        summaries, summary_mark = self._summaries_since(self.summary_mark)
+        sales, sale_mark = self._sales_for(self._sold_since(self.sale_mark), now)
+        self.db.session.rollback()
+        with self._lock:
+            for row in summaries:
+                self.graph.update(
+                    row.from_currency, row.to_currency, row.league,
+                    row.mean, row.weight)
+            for key, aggregate in sales.items():
+                if aggregate is None:
+                    self.sales.pop(key, None)
+                else:
+                    self.sales[key] = aggregate
+            self.summary_mark = summary_mark or self.summary_mark
+            self.sale_mark = sale_mark or self.sale_mark
+        if summaries or sales:
+            self.logger.debug(
+                "Refreshed %s currency summaries and %s sale aggregates",
+                len(summaries), len(sales))
+
+    def reload(self, now=None):
+        now = int(time.time()) if now is None else now
+        graph = CurrencyGraph(logger=self.logger)
+        graph.load(self.db.session)
+        summary_mark = self.db.session.query(
+            sqlalchemy.func.max(fixer.CurrencySummary.updated_at)).scalar()
+        sale_mark = self.db.session.query(
+            sqlalchemy.func.max(fixer.Sale.updated_at)).scalar()
+        sales = self._aggregate(None, now)
+        self.db.session.rollback()
+        with self._lock:
+            self.graph = graph
+            self.sales = sales
+            self.summary_mark = summary_mark
+            self.sale_mark = sale_mark
+            self.loaded_at = now
+        self.logger.info(
+            "Loaded prices for %s leagues and %s recently sold items",
+            len(graph.leagues), len(sales))
+
+    def leagues(self):
+        with self._lock:
+            return sorted(
+                set(self.graph.leagues).union(
+                    league for league, name in self.sales))
+
+    def price(self, name, league):
+        with self._lock:
+            return self._price(name, league)
+
+    def prices(self, queries):
+        # One lock for the batch, so it sees a single refresh
+        with self._lock:
+            return [self._price(name, league) for name, league in queries]
+
+    def _price(self, name, league):
+        rate = None
+        # Unknown leagues would otherwise leave empty paths cached
+        if league in self.graph.leagues:
+            rate = self.graph.find_rate(name, league)
+        if rate is not None:
+            return {
+                'name': name,
+                'league': league,
+                'chaos': rate,
+                'source': 'currency',
+                'path': self.graph.path(name, league) or [CHAOS]}
+        aggregate = self.sales.get((league, name))
+        if aggregate is not None:
+            return {
+                'name': name,
+                'league': league,
+                'chaos': aggregate.mean,
+                'source': 'sales',
+                'count': aggregate.count,
+                'low': aggregate.low,
+                'high': aggregate.high,
+                'last_sale': aggregate.last_sale}
+        return None
+
+    def _summaries_since(self, mark):
+        query = self.db.session.query(
+            fixer.CurrencySummary.from_currency,
+            fixer.CurrencySummary.to_currency,
+            fixer.CurrencySummary.league,
+            fixer.CurrencySummary.mean,
+            fixer.CurrencySummary.weight,
+            fixer.CurrencySummary.updated_at)
+        if mark is not None:
+            query = query.filter(
+                fixer.CurrencySummary.updated_at >= mark - self.overlap)
+        rows = query.all()
+        return (rows, max((row.updated_at for row in rows), default=None))
+
+    def _sold_since(self, mark):
+        query = self.db.session.query(
+            fixer.Sale.league, fixer.Sale.name, fixer.Sale.updated_at)
+        query = query.filter(fixer.Sale.is_currency == False)
+        if mark is not None:
+            query = query.filter(fixer.Sale.updated_at >= mark - self.overlap)
+        return query.all()
+
+    def _sales_for(self, rows, now):
+        if not rows:
+            return ({}, None)
+        keys = set((row.league, row.name) for row in rows)
+        found = {}
+        names = sorted(set(name for league, name in keys))
+        for offset in range(0, len(names), self.lookup_chunk):
+            found.update(self._aggregate(
+                names[offset:offset+self.lookup_chunk], now))
+        # Keys with no sale left in the window are dropped from the index
+        sales = dict((key, found.get(key)) for key in keys)
+        return (sales, max(row.updated_at for row in rows))
+
+    def _aggregate(self, names, now):
+        Sale = fixer.Sale
+        query = self.db.session.query(
+            Sale.league,
+            Sale.name,
+            sqlalchemy.func.count(Sale.id),
+            sqlalchemy.func.avg(Sale.sale_amount_chaos),
+            sqlalchemy.func.min(Sale.sale_amount_chaos),
+            sqlalchemy.func.max(Sale.sale_amount_chaos),
+            sqlalchemy.func.max(Sale.item_updated_at))
+        query = query.filter(Sale.is_currency == False)
+        query = query.filter(Sale.sale_amount_chaos != None)
+        query = query.filter(Sale.item_updated_at > now - self.sale_window)
+        if names is not None:
+            query = query.filter(Sale.name.in_(names))
+        query = query.group_by(Sale.league, Sale.name)
+        return dict(
+            ((league, name), SaleAggregate(
+                count, float(mean), low, high, last_sale))
+            for league, name, count, mean, low, high, last_sale in query.all())
\ No newline at end of file
@@ -1,15 +1,17 @@
 import time
-import math
-import numpy
+import heapq
 import logging
 import datetime
+import itertools
+import threading
 
 import sqlalchemy
 
 import fixer
-from .currency_abbreviations import \
-    PRICE_RE, PRICE_WITH_SPACE_RE, \
-    OFFICIAL_CURRENCIES, UNOFFICIAL_CURRENCIES
+from .currency_graph import CurrencyGraph
+from .note_parser import NoteParser
+from .running_stats import RunningStats
+from .summary_cache import SummaryCache
 
 
 class CurrencyPostprocessor:
@@ -20,6 +22,10 @@ class CurrencyPostprocessor:
     limit = None
     actual_currencies = {}
     recent = None
+    block_size = 1000
+    idle_timeout = 60
+    checkpoint_name = 'currency'
+    commit_lag = fixer.COMMIT_LAG
     relevant = int(datetime.timedelta(days=15).total_seconds())
     weight_increment = int(datetime.timedelta(hours=12).total_seconds())
 
@@ -27,12 +33,31 @@ class CurrencyPostprocessor:
             continuous=False,
             recent=600,
             limit=None,
+            block_size=None,
+            leagues=None,
+            notifier=None,
+            prepare=True,
             logger=logging):
         self.db = db
         self.start_time = start_time
         self.continuous = continuous
+        self.prepare = prepare
         self.limit = limit
+        self.leagues = leagues
+        self.notifier = notifier
         self.logger = logger
+        if block_size is not None:
+            self.block_size = block_size
+        self.graph = CurrencyGraph(logger=logger)
+        self.note_parser = NoteParser(logger=logger)
+        self.summary_cache = SummaryCache()
+        # (updated_at, id) of rows handled within the reread window
+        self.seen = set()
+        # When a pass last reread behind its position
+        self.reread_at = None
+        self.stopping = threading.Event()
+        self.stats = RunningStats(
+            self.relevant, self.weight_increment, logger=logger)
         if recent is None or isinstance(recent, int):
             self.recent = recent
         elif isinstance(recent, datetime.timedelta):
@@ -44,11 +69,20 @@ class CurrencyPostprocessor:
                 self.log("Invalid 'recent' caching parameter: %r", recent)
                 raise
 
+    def stop(self):
+        # A continuous run finishes the items written so far, then returns
+        self.stopping.set()
+        if self.notifier is not None:
+            # Only wakes the wait for items; the mark is not used
+            self.notifier.publish(0)
+
     def get_actual_currencies(self):
 
         def get_full_names():
-            query = self.db.session.query(fixer.CurrencySummary)
-            query = query.add_columns(fixer.CurrencySummary.from_currency)
+            # Across all leagues: a shard's graph only holds its own, but
+            # notes are parsed against every currency ever summarized
+            query = self.db.session.query(
+                fixer.CurrencySummary.from_currency)
             query = query.distinct()
 
             for row in query.all():
@@ -72,39 +106,26 @@ class CurrencyPostprocessor:
 
         return mapping
 
-    def parse_note(self, note, regex=None):
-        if note is not None:
-            match = (regex or PRICE_RE).search(note)
-            if match:
-                try:
-                    (sale_type, amt, currency) = match.groups()
-                    low_cur = currency.lower()
-                    if '/' in amt:
-                        num, den = amt.split('/', 1)
-                        amt = float(num) / float(den)
-                    else:
-                        amt = float(amt)
-                    if  low_cur in OFFICIAL_CURRENCIES:
-                        return (amt, OFFICIAL_CURRENCIES[low_cur])
-                    elif low_cur in UNOFFICIAL_CURRENCIES:
-                        return (amt, UNOFFICIAL_CURRENCIES[low_cur])
-                    elif low_cur in self.actual_currencies:
-                        return (amt, self.actual_currencies[low_cur])
-                    elif currency:
-                        if regex is None:
-                            return self.parse_note(
-                                note, regex=PRICE_WITH_SPACE_RE)
-                        self.logger.warning(
-                            "Currency note: %r has unknown currency abbrev %s",
-                            note, currency)
-                except ValueError as e:
-                    if 'float' in str(e):
-                        self.logger.debug("Invalid price: %r" % note)
-                    else:
-                        raise
-        return (None, None)
-
-    def _currency_query(self, start, block_size, offset):
+    def parse_note(self, note):
+        return self.note_parser.parse(note)
+
+    def parse_notes(self, notes):
+        return self.note_parser.parse_many(notes)
+
+    def _currency_rows(self, start, block_size, after=None):
+        if not self.leagues:
+            return self._currency_query(start, block_size, after).all()
+        # league IN (...) cannot be read in (updated_at, id) order from
+        # ix_item_league_updated_at_id, so each league gets its own range
+        # scan and the sorted streams are merged.
+        streams = [
+            self._currency_query(start, block_size, after, league).all()
+            for league in self.leagues]
+        merged = heapq.merge(
+            *streams, key=lambda row: (row.Item.updated_at, row.Item.id))
+        return list(itertools.islice(merged, block_size))
+
+    def _currency_query(self, start, block_size, after=None, league=None):
 
         Item = fixer.Item
 
@@ -122,12 +143,22 @@ class CurrencyPostprocessor:
             fixer.Item.name,
             fixer.Stash.public)
         query = query.filter(fixer.Stash.public == True)
+        if league is not None:
+            query = query.filter(Item.league == league)
         if start is not None:
             query = query.filter(fixer.Item.updated_at >= start)
-        query = query.order_by(
-            Item.updated_at, Item.created_at, Item.id).limit(block_size)
-        if offset:
-            query = query.offset(offset)
+        if after is not None:
+            # Keyset position, served by ix_item_updated_at_id
+            after_updated_at, after_id = after
+            # The plain range bound lets the planner skip older rows
+            # (and archived periods) before applying the keyset test
+            query = query.filter(Item.updated_at >= after_updated_at)
+            query = query.filter(sqlalchemy.or_(
+                Item.updated_at > after_updated_at,
+                sqlalchemy.and_(
+                    Item.updated_at == after_updated_at,
+                    Item.id > after_id)))
+        query = query.order_by(Item.updated_at, Item.id).limit(block_size)
 
         return query
 
@@ -140,63 +171,26 @@ class CurrencyPostprocessor:
         return self.find_value_of(currency, league, price)
 
     def _get_mean_and_std(self, name, currency, league, sale_time):
-
-        def calc_mean_std(values, weights):
-            mean = numpy.average(values, weights=weights)
-            variance = numpy.average((values-mean)**2, weights=weights)
-            stddev = math.sqrt(variance)
-
-            return (mean, stddev)
-
-        now = int(time.time())
-        query = self.db.session.query(fixer.Sale)
-        query = query.join(
-            fixer.Item, fixer.Sale.item_id == fixer.Item.id)
-        query = query.filter(fixer.Sale.name == name)
-        query = query.filter(fixer.Item.league == league)
-        query = query.filter(fixer.Sale.sale_currency == currency)
-        query = query.filter(
-            fixer.Sale.item_updated_at > (now-self.relevant))
-        query = query.add_columns(
-            fixer.Sale.sale_amount,
-            fixer.Sale.item_updated_at)
-
-        values = numpy.array([(
-            row.sale_amount,
-            self.weight_increment/max(1,sale_time-row.item_updated_at))
-            for row in query.all()])
-        if len(values) == 0:
-            return (None, None, None, None)
-        prices = values[:,0]
-        weights = values[:,1]
-        mean, stddev = calc_mean_std(prices, weights)
-        count = len(prices)
-        total_weight = weights.sum()
-
-        if count > 3 and stddev > mean/2:
-            self.logger.debug(
-                "%s->%s: Large stddev=%s vs mean=%s, recalibrating",
-                name, currency, stddev, mean)
-            prices_ok = numpy.absolute(prices-mean) <= stddev*2
-            prices = numpy.extract(prices_ok, prices)
-            weights = numpy.extract(prices_ok, weights)
-            mean, stddev = calc_mean_std(prices, weights)
-            count2 = len(prices)
-            total_weight = weights.sum()
-            self.logger.debug(
-                "Recalibration ignored %s rows, final stddev=%s, mean=%s",
-                count - count2, stddev, mean)
-            count = count2
-
-        return (float(mean), float(stddev), float(total_weight), count)
+        return self.stats.mean_and_std(
+            self.db.session, name, currency, league, sale_time,
+            int(time.time()))
 
     def _update_currency_summary(
             self, name, currency, league, price, sale_time):
-        query = self.db.session.query(fixer.CurrencySummary)
-        query = query.filter(fixer.CurrencySummary.from_currency == name)
-        query = query.filter(fixer.CurrencySummary.to_currency == currency)
-        query = query.filter(fixer.CurrencySummary.league == league)
-        existing = query.one_or_none()
+        key = (name, currency, league)
+        existing = self.summary_cache.get(key)
+        if existing is None:
+            query = self.db.session.query(
+                fixer.CurrencySummary.count,
+                fixer.CurrencySummary.updated_at,
+                fixer.CurrencySummary.mean)
+            query = query.filter(fixer.CurrencySummary.from_currency == name)
+            query = query.filter(fixer.CurrencySummary.to_currency == currency)
+            query = query.filter(fixer.CurrencySummary.league == league)
+            row = query.one_or_none()
+            if row is not None:
+                existing = self.summary_cache.put(
+                    key, row.count, row.updated_at, row.mean)
 
         now = int(time.time())
 
@@ -204,7 +198,7 @@ class CurrencyPostprocessor:
                 self.recent and
                 existing and
                 existing.count >= 10 and
-                existing and existing.updated_at >= now-self.recent):
+                existing.updated_at >= now-self.recent):
             self.logger.debug(
                 "Skipping cached currency: %s->%s %s(%s)",
                 name, currency, league, price)
@@ -235,134 +229,102 @@ class CurrencyPostprocessor:
                 'to_currency': currency,
                 'league': league,
                 'created_at': int(time.time())}
+        updated_at = int(time.time())
         cmd = cmd.values(
             count=count,
             mean=weighted_mean,
             weight=weight,
             standard_dev=weighted_stddev,
-            updated_at=int(time.time()), **add_values)
+            updated_at=updated_at, **add_values)
         self.db.session.execute(cmd)
+        self.summary_cache.put(key, count, updated_at, weighted_mean)
+        self.graph.update(name, currency, league, weighted_mean, weight)
 
     def find_value_of(self, name, league, price):
 
         if name == 'Chaos Orb':
             return price
 
-        from_currency_field = fixer.CurrencySummary.from_currency
-        to_currency_field = fixer.CurrencySummary.to_currency
-        league_field = fixer.CurrencySummary.league
-
-        query = self.db.session.query(fixer.CurrencySummary)
-        query = query.filter(from_currency_field == name)
-        query = query.filter(league_field == league)
-        query = query.order_by(fixer.CurrencySummary.weight.desc())
-        high_score = None
-        conversion = None
-        for row in query.all():
-            target = row.to_currency
-            if target == 'Chaos Orb':
-                if not high_score or row.weight >= high_score:
-                    self.logger.debug(
-                        "Conversion discovered %s -> Chaos = %s",
-                        name, row.mean)
-                    high_score = row.weight
-                    conversion = row.mean
-                break
-            if high_score and row.weight <= high_score:
-                continue
-
-            query2 = self.db.session.query(fixer.CurrencySummary)
-            query2 = query2.filter(from_currency_field == target)
-            query2 = query2.filter(to_currency_field == 'Chaos Orb')
-            query2 = query2.filter(league_field == league)
-            row2 = query2.one_or_none()
-            if row2:
-                score = min(row.weight, row2.weight)
-                if (not high_score) or score > high_score:
-                    high_score = score
-                    conversion = row.mean * row2.mean
-                    self.logger.debug(
-                        "Conversion discovered %s -> %s (%s) -> Chaos (%s) = %s",
-                        name, target, row.mean, row2.mean, conversion)
-
-        if high_score:
-            return conversion * price
-        else:
-            query = self.db.session.query(fixer.CurrencySummary)
-            query = query.filter(from_currency_field == 'Chaos Orb')
-            query = query.filter(to_currency_field == name)
-            query = query.filter(league_field == league)
-            row = query.one_or_none()
-
-            if row:
-                inverse = 1.0/row.mean
-                if row:
-                    self.logger.debug(
-                        "Falling back on inverse Chaos -> %s pricing: %s",
-                        name, inverse)
-                    return inverse * price
+        rate = self.graph.find_rate(name, league)
+        if rate is None:
+            return None
+        return rate * price
 
-        return None
+    def _is_priced(self, row):
+        return (
+            (row.Item.note and row.Item.note.startswith('~')) or
+            row.stash.startswith('~'))
 
-    def _process_sale(self, row):
-        if not (
-                (row.Item.note and row.Item.note.startswith('~')) or
-                row.stash.startswith('~')):
+    def _process_sale(self, row, note_price, stash_price):
+        if not self._is_priced(row):
             return None
         is_currency = 'currency' in row.Item.category
         if is_currency:
             name = row.Item.typeLine
         else:
             name = (row.Item.name + " " + row.Item.typeLine).strip()
-        pricing = row.Item.note
-        stash_pricing = row.stash
-        stash_price, stash_currency = self.parse_note(stash_pricing)
-        price, currency = self.parse_note(pricing)
+        stash_price, stash_currency = stash_price
+        price, currency = note_price
         if price is None:
             price, currency = (stash_price, stash_currency)
         if price is None or price == 0:
             return None
-        existing = self.db.session.query(fixer.Sale).filter(
-            fixer.Sale.item_id == row.Item.id).one_or_none()
-
-        if not existing:
-            existing = fixer.Sale(
-                item_id=row.Item.id,
-                item_api_id=row.Item.api_id,
-                name=name,
-                is_currency=is_currency,
-                sale_currency=currency,
-                sale_amount=price,
-                sale_amount_chaos=None,
-                created_at=int(time.time()),
-                item_updated_at=row.Item.updated_at,
-                updated_at=int(time.time()))
-        else:
-            existing.sale_currency = currency
-            existing.sale_amount = price
-            existing.sale_amount_chaos = None
-            existing.item_updated_at = row.Item.updated_at
-            existing.updated_at = int(time.time())
-
-        self.db.session.add(existing)
-
-        league = row.Item.league
-
-        amount_chaos = self._update_currency_pricing(
-            name, currency, league, price, row.Item.updated_at, is_currency)
-
-        if amount_chaos is not None:
-            self.logger.debug(
-                "Found chaos value of %s -> %s %s = %s",
-                name, price, currency, amount_chaos)
-
-            existing.sale_amount_chaos = amount_chaos
-            self.db.session.merge(existing)
+        now = int(time.time())
 
-        return existing.id
+        return {
+            'item_id': row.Item.id,
+            'item_api_id': row.Item.api_id,
+            'name': name,
+            'is_currency': is_currency,
+            'sale_currency': currency,
+            'sale_amount': price,
+            'sale_amount_chaos': None,
+            'league': row.Item.league,
+            'created_at': now,
+            'item_updated_at': row.Item.updated_at,
+            'updated_at': now}
+
+    def _save_sales(self, sales):
+        if not sales:
+            return
+        existing = self.db.lookup_sales(
+            sale['item_api_id'] for sale in sales)
+        # Stats must be loaded before any of this block is applied to them
+        self.stats.load_many(
+            self.db.session,
+            ((sale['name'], sale['sale_currency'], sale['league'])
+             for sale in sales if sale['is_currency']),
+            int(time.time()))
+
+        for sale in sales:
+            league = sale['league']
+            name = sale['name']
+            currency = sale['sale_currency']
+            price = sale['sale_amount']
+            old = existing.get(sale['item_api_id'])
+            if old is not None:
+                self.stats.remove(
+                    old.name, old.sale_currency, league,
+                    old.item_updated_at, old.sale_amount)
+            self.stats.add(
+                name, currency, league, sale['item_updated_at'], price)
+
+            amount_chaos = self._update_currency_pricing(
+                name, currency, league, price, sale['item_updated_at'],
+                sale['is_currency'])
+
+            if amount_chaos is not None:
+                self.logger.debug(
+                    "Found chaos value of %s -> %s %s = %s",
+                    name, price, currency, amount_chaos)
+                sale['sale_amount_chaos'] = amount_chaos
+
+        self.db.upsert_sales(sales)
 
     def get_last_processed_time(self):
         query = self.db.session.query(fixer.Sale)
+        if self.leagues:
+            query = query.filter(fixer.Sale.league.in_(self.leagues))
         query = query.order_by(fixer.Sale.item_updated_at.desc()).limit(1)
         result = query.one_or_none()
         if result:
@@ -377,7 +339,7 @@ class CurrencyPostprocessor:
         return None
 
 
-    def do_currency_postprocessor(self):
+    def prepare_database(self):
 
         def create_table(table, name):
             try:
@@ -392,59 +354,137 @@ class CurrencyPostprocessor:
 
         create_table(fixer.Sale, "Sale")
         create_table(fixer.CurrencySummary, "Currency Summary")
+        create_table(fixer.Checkpoint, "Checkpoint")
+        self.db.upgrade_database()
+
+    def do_currency_postprocessor(self):
+
+        if self.prepare:
+            self.prepare_database()
+        # Only this process writes summaries for these leagues, so the
+        # graph stays current through update() once loaded.
+        self.graph.load(self.db.session, leagues=self.leagues)
+        if self.continuous and self.notifier is not None:
+            self.notifier.listen()
+
+        start = self.start_time
+        position = None
+        if start is None:
+            position = self.db.get_checkpoint(
+                self.checkpoint_name, self.leagues)
+        if position is None and start is None:
+            # Databases processed before checkpoints were kept
+            start = self.get_last_processed_time()
+        if position:
+            when = time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(position[0]))
+            self.logger.info(
+                "Resuming after item %s (%s)", position[1], when)
+        elif start:
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start))
+            self.logger.info("Starting from %s", when)
+        else:
+            self.logger.info("Starting from beginning of item data.")
 
-        prev = None
         while True:
+            # Items written before a stop still get a pass
+            stopping = self.stopping.is_set()
             self.actual_currencies = self.get_actual_currencies()
-            start = self.start_time or self.get_last_processed_time()
-            if start:
-                when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start))
-                self.logger.info("Starting from %s", when)
-            else:
-                self.logger.info("Starting from beginning of item data.")
-            (rows_done, last_row) = self._currency_processor_single_pass(start)
-            if not prev or last_row != prev:
-                prev = last_row
+            self.note_parser.set_actual_currencies(self.actual_currencies)
+            (rows_done, after) = self._currency_processor_single_pass(
+                start, position)
+            progressed = after != position
+            if progressed:
+                position = after
                 self.logger.info("Processed %s rows in a pass", rows_done)
-            elif self.continuous:
-                time.sleep(1)
+                self.logger.debug(
+                    "Summary cache: %r", self.summary_cache.stats())
+            elif self.continuous and not stopping:
+                self._wait_for_items()
 
-            if not self.continuous:
+            if not self.continuous or (stopping and not progressed):
                 break
 
-    def _currency_processor_single_pass(self, start):
+    def _wait_for_items(self):
+        if self.notifier is None:
+            time.sleep(1)
+            return
+        mark = self.notifier.wait(self.idle_timeout)
+        if mark is None:
+            self.logger.debug(
+                "No items written in %ss, checking anyway", self.idle_timeout)
+        else:
+            self.logger.debug("Items written up to %s", mark)
+
+    def _currency_processor_single_pass(self, start, after=None):
 
-        offset = 0
         count = 0
         all_processed = 0
         todo = True
-        block_size = 1000
-        last_row = None
+        # A row can commit up to commit_lag after rows stamped later than
+        # it have been read. So once every commit_lag, and on the first
+        # pass, a pass rereads twice that far behind its position, which
+        # covers every row that committed since the last reread, and
+        # skips what it has already handled. Other passes go on from the
+        # position itself. After a restart the window is handled again,
+        # which only rewrites the same sales.
+        cursor = after
+        now = time.monotonic()
+        if after is not None and (
+                self.reread_at is None or
+                now - self.reread_at >= self.commit_lag):
+            cursor = (after[0] - 2*self.commit_lag, 0)
+            self.reread_at = now
 
         while todo:
-            query = self._currency_query(start, block_size, offset)
+            block = self._currency_rows(start, self.block_size, cursor)
+            if block:
+                last = block[-1].Item
+                cursor = (last.updated_at, last.id)
+                after = max(after, cursor) if after else cursor
+            rows = [
+                row for row in block
+                if (row.Item.updated_at, row.Item.id) not in self.seen]
+            priced = [
+                row for row in rows
+                if (row.Item.note or row.stash) and self._is_priced(row)]
+            prices = dict(zip(
+                (row.Item.id for row in priced),
+                zip(self.parse_notes(row.Item.note for row in priced),
+                    self.parse_notes(row.stash for row in priced))))
             count = 0
-            for row in query.all():
+            sales = []
+            for row in rows:
+                self.seen.add((row.Item.updated_at, row.Item.id))
                 if not (row.Item.note or row.stash):
                     continue
-                max_id = row.Item.id
                 count += 1
                 self.logger.debug("Row in %s" % row.Item.id)
-                if count % 1000 == 0:
+                if (all_processed + count) % 1000 == 0:
                     self.logger.info(
                         "%s rows in... (%s)",
-                        count + offset, row.Item.updated_at)
+                        all_processed + count, row.Item.updated_at)
 
-                row_id = self._process_sale(row)
+                sale = self._process_sale(
+                    row, *prices.get(row.Item.id, (None, None)))
+                if sale:
+                    sales.append(sale)
 
-                if row_id:
-                    last_row = row_id
+            self._save_sales(sales)
+            if rows:
+                # Same transaction as the block's sales, so a restart
+                # resumes no later than the rows written here
+                self.db.save_checkpoint(
+                    self.checkpoint_name, self.leagues, after)
 
-            todo = count == block_size
-            offset += count
+            todo = len(block) == self.block_size
             self.db.session.commit()
+            if after is not None:
+                self.seen = set(
+                    key for key in self.seen
+                    if key[0] >= after[0] - 2*self.commit_lag)
             all_processed += count
             if self.limit and all_processed > self.limit:
                 break
 
-        return (all_processed, last_row)
\ No newline at end of file
+        return (all_processed, after)
\ No newline at end of file
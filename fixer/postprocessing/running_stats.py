@@ -0,0 +1,267 @@
+import math
+import heapq
+import logging
+
+import numpy
+
+import fixer
+
+
+# weight_increment/age is kept as a sum of exponentials, so that every
+# term of it decays by a single factor as time advances:
+#   1/x ~ sum(DECAY_STEP * r * exp(-r*x) for r in DECAY_RATES)
+# the trapezoid rule on the integral of exp(-x*e**u)*e**u du. It is within
+# 2e-6 of 1/x for ages from 1s to about a month.
+DECAY_STEP = 0.6
+DECAY_RATES = numpy.exp(numpy.arange(-30, 3.5, DECAY_STEP))
+DECAY_COEFFS = DECAY_STEP * DECAY_RATES
+
+
+class SaleStats:
+
+    def __init__(self):
+        # Sales before self.when are summed per decay term as of
+        # self.when; later ones are pending and weigh 1 until time
+        # passes them.
+        self.when = None
+        self.shift = None
+        self.count = 0
+        # Live sales, one slot per (sale_time, price), packed into arrays
+        # so that weighing all of them is one vector operation
+        self.slots = {}
+        self.keys = []
+        self.times = numpy.zeros(16)
+        self.prices = numpy.zeros(16)
+        self.counts = numpy.zeros(16)
+        self.expiry = []
+        self.pending = {}
+        self.pending_times = []
+        self.pending_sums = [0, 0.0, 0.0]
+        self.sums = numpy.zeros((3, len(DECAY_RATES)))
+
+    def add(self, sale_time, price):
+        if self.shift is None:
+            # Moments of price-shift keep E[p**2]-E[p]**2 well conditioned
+            self.shift = price
+        key = (sale_time, price)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self._new_slot(key)
+        self.counts[slot] += 1
+        heapq.heappush(self.expiry, key)
+        self.count += 1
+        if self.when is None or sale_time >= self.when:
+            self._pend(key, 1)
+        else:
+            self._fold(key, 1)
+
+    def remove(self, sale_time, price):
+        key = (sale_time, price)
+        if key in self.slots:
+            self._forget(key, 1)
+
+    def moments(self, sale_time, cutoff):
+        # (weight, weighted sum, weighted square sum) of price-shift, in
+        # units of weight_increment
+        self.expire(cutoff)
+        if self.when is not None and sale_time < self.when:
+            return self._exact_moments(sale_time)
+        self.advance(sale_time)
+        folded = self.sums.dot(DECAY_COEFFS)
+        return tuple(
+            float(folded[term] + self.pending_sums[term])
+            for term in range(3))
+
+    def sales(self, sale_time, cutoff):
+        # (prices, weights, counts) of the live sales, weighed exactly;
+        # only needed to recalibrate, where each price counts separately
+        self.expire(cutoff)
+        return self._weigh(sale_time)
+
+    def advance(self, when):
+        if self.when is not None and when <= self.when:
+            return
+        if self.when is not None:
+            self.sums *= numpy.exp(-DECAY_RATES * (when - self.when))
+        self.when = when
+        while self.pending_times and self.pending_times[0][0] < when:
+            key = heapq.heappop(self.pending_times)
+            count = self.pending.get(key, 0)
+            if count:
+                self._pend(key, -count)
+                self._fold(key, count)
+
+    def expire(self, cutoff):
+        while self.expiry and self.expiry[0][0] <= cutoff:
+            key = heapq.heappop(self.expiry)
+            if key in self.slots:
+                self._forget(key, int(self.counts[self.slots[key]]))
+
+    def _new_slot(self, key):
+        slot = len(self.slots)
+        if slot == len(self.counts):
+            for name in ('times', 'prices', 'counts'):
+                grown = numpy.zeros(slot * 2)
+                grown[:slot] = getattr(self, name)
+                setattr(self, name, grown)
+        self.slots[key] = slot
+        self.keys.append(key)
+        self.times[slot], self.prices[slot] = key
+        self.counts[slot] = 0
+        return slot
+
+    def _forget(self, key, count):
+        sale_time, price = key
+        if self.when is None or sale_time >= self.when:
+            self._pend(key, -count)
+        else:
+            self._fold(key, -count)
+        slot = self.slots[key]
+        self.counts[slot] -= count
+        if not self.counts[slot]:
+            # The last slot moves into the freed one
+            del self.slots[key]
+            moved = self.keys.pop()
+            if moved != key:
+                self.slots[moved] = slot
+                self.keys[slot] = moved
+                self.times[slot], self.prices[slot] = moved
+                self.counts[slot] = self.counts[len(self.keys)]
+        self.count -= count
+        if not self.count:
+            # Nothing left, so drop any rounding left in the sums
+            self.sums[:] = 0
+            self.pending_sums = [0, 0.0, 0.0]
+
+    def _pend(self, key, count):
+        remaining = self.pending.get(key, 0) + count
+        if remaining:
+            self.pending[key] = remaining
+        else:
+            self.pending.pop(key, None)
+        if count > 0:
+            heapq.heappush(self.pending_times, key)
+        offset = key[1] - self.shift
+        self.pending_sums[0] += count
+        self.pending_sums[1] += count * offset
+        self.pending_sums[2] += count * offset * offset
+
+    def _fold(self, key, count):
+        sale_time, price = key
+        weights = count * numpy.exp(-DECAY_RATES * (self.when - sale_time))
+        offset = price - self.shift
+        self.sums[0] += weights
+        self.sums[1] += weights * offset
+        self.sums[2] += weights * offset * offset
+
+    def _weigh(self, sale_time):
+        size = len(self.keys)
+        counts = self.counts[:size]
+        weights = counts / numpy.maximum(1, sale_time - self.times[:size])
+        return (self.prices[:size], weights, counts)
+
+    def _exact_moments(self, sale_time):
+        # Only for a sale older than one already priced, where the running
+        # sums cannot be turned back
+        prices, weights, _ = self._weigh(sale_time)
+        offsets = prices - self.shift
+        return (
+            weights.sum(), (weights * offsets).sum(),
+            (weights * offsets * offsets).sum())
+
+
+class RunningStats:
+
+    def __init__(self, relevant, weight_increment, logger=logging):
+        self.relevant = relevant
+        self.weight_increment = weight_increment
+        self.logger = logger
+        self.stats = {}
+
+    def add(self, name, currency, league, sale_time, price):
+        stats = self.stats.get((name, currency, league))
+        if stats is not None:
+            stats.add(sale_time, price)
+
+    def remove(self, name, currency, league, sale_time, price):
+        stats = self.stats.get((name, currency, league))
+        if stats is not None:
+            stats.remove(sale_time, price)
+
+    def clear(self):
+        self.stats = {}
+
+    def load(self, session, name, currency, league, now):
+        self.load_many(session, [(name, currency, league)], now)
+        return self.stats[(name, currency, league)]
+
+    def load_many(self, session, keys, now):
+        # Must run after the session holds every sale for the keys, as
+        # only keys that are already loaded are kept current by add/remove.
+        keys = set(keys).difference(self.stats)
+        if not keys:
+            return
+        for key in keys:
+            self.stats[key] = SaleStats()
+        # Served by ix_sale_league_name_currency_time alone
+        query = session.query(fixer.Sale)
+        query = query.filter(
+            fixer.Sale.name.in_(set(key[0] for key in keys)))
+        query = query.filter(
+            fixer.Sale.sale_currency.in_(set(key[1] for key in keys)))
+        query = query.filter(
+            fixer.Sale.league.in_(set(key[2] for key in keys)))
+        query = query.filter(
+            fixer.Sale.item_updated_at > (now-self.relevant))
+        query = query.with_entities(
+            fixer.Sale.name,
+            fixer.Sale.sale_currency,
+            fixer.Sale.league,
+            fixer.Sale.sale_amount,
+            fixer.Sale.item_updated_at)
+        for row in query.all():
+            key = (row.name, row.sale_currency, row.league)
+            if key in keys:
+                self.stats[key].add(row.item_updated_at, row.sale_amount)
+        self.logger.debug("Loaded running stats for %s pairs", len(keys))
+
+    def mean_and_std(self, session, name, currency, league, sale_time, now):
+
+        def calc_mean_std(prices, weights):
+            mean = numpy.average(prices, weights=weights)
+            variance = numpy.average((prices-mean)**2, weights=weights)
+            return (mean, math.sqrt(variance))
+
+        stats = self.stats.get((name, currency, league))
+        if stats is None:
+            stats = self.load(session, name, currency, league, now)
+        total_weight, first, second = stats.moments(
+            sale_time, now-self.relevant)
+        count = stats.count
+        if not count or total_weight <= 0:
+            return (None, None, None, None)
+        mean = first / total_weight
+        stddev = math.sqrt(max(0.0, second / total_weight - mean*mean))
+        mean += stats.shift
+
+        if count > 3 and stddev > mean/2:
+            self.logger.debug(
+                "%s->%s: Large stddev=%s vs mean=%s, recalibrating",
+                name, currency, stddev, mean)
+            # Only here are the weights of individual sales needed
+            prices, weights, counts = stats.sales(
+                sale_time, now-self.relevant)
+            prices_ok = numpy.absolute(prices-mean) <= stddev*2
+            prices = prices[prices_ok]
+            weights = weights[prices_ok]
+            mean, stddev = calc_mean_std(prices, weights)
+            total_weight = weights.sum()
+            count2 = int(counts[prices_ok].sum())
+            self.logger.debug(
+                "Recalibration ignored %s rows, final stddev=%s, mean=%s",
+                count - count2, stddev, mean)
+            count = count2
+
+        return (
+            float(mean), float(stddev),
+            float(total_weight * self.weight_increment), count)
\ No newline at end of file
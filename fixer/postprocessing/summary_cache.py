@@ -0,0 +1,61 @@
+import time
+import collections
+
+
+SummaryEntry = collections.namedtuple('SummaryEntry', 'count updated_at mean')
+
+
+class SummaryCache:
+
+    ttl = 600
+    max_size = 10000
+
+    def __init__(self, ttl=None, max_size=None, clock=time.monotonic):
+        if ttl is not None:
+            self.ttl = ttl
+        if max_size is not None:
+            self.max_size = max_size
+        self.clock = clock
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key):
+        found = self.entries.get(key)
+        if found is None:
+            self.misses += 1
+            return None
+        stored_at, entry = found
+        if self.clock() - stored_at > self.ttl:
+            del self.entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, count, updated_at, mean):
+        entry = SummaryEntry(count, updated_at, mean)
+        self.entries[key] = (self.clock(), entry)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'evictions': self.evictions}
\ No newline at end of file
@@ -0,0 +1,120 @@
+import time
+import logging
+import threading
+
+
+class RateLimiter:
+
+    interval = 1.1
+    margin = 1.05
+    penalty = 60
+
+    def __init__(self, interval=None, clock=time.monotonic, logger=logging):
+        if interval is not None:
+            self.interval = interval
+        self.logger = logger
+        self.clock = clock
+        self.capacity = 1.0
+        self.tokens = 1.0
+        self.updated = clock()
+        self.blocked_until = 0.0
+        self.waited = 0.0
+        self.waits = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            delay = max(0.0, self.blocked_until - now)
+            if self.tokens < 1:
+                delay = max(delay, (1 - self.tokens) * self.interval)
+            self.tokens -= 1
+            self.requests += 1
+            if delay > 0:
+                self.waited += delay
+                self.waits += 1
+            return delay
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            self.logger.debug("Rate limit wait: %.3fs", delay)
+            time.sleep(delay)
+
+    def restart(self):
+        with self._lock:
+            self.updated = self.clock()
+            self.tokens = min(self.tokens, 0.0)
+
+    def update(self, headers, status=None):
+        rules = headers.get('X-Rate-Limit-Rules')
+        retry_after = headers.get('Retry-After')
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            if rules:
+                try:
+                    self._apply_rules(now, headers, rules.split(','))
+                except ValueError:
+                    self.logger.warning(
+                        "Ignoring unparsable rate limit rules: %r", rules)
+            if retry_after:
+                try:
+                    self._block(now, float(retry_after))
+                except ValueError:
+                    self.logger.warning(
+                        "Ignoring unparsable Retry-After: %r", retry_after)
+            elif status == 429 and self.blocked_until <= now:
+                self._block(now, self.penalty)
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'capacity': self.capacity,
+            'requests': self.requests,
+            'waits': self.waits,
+            'waited': self.waited}
+
+    def _refill(self, now):
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(self.capacity, self.tokens + elapsed/self.interval)
+        self.updated = now
+
+    def _block(self, now, seconds):
+        self.logger.warning("Rate limited by server for %ss", seconds)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def _apply_rules(self, now, headers, rules):
+        limits = []
+        for rule in rules:
+            rule = rule.strip()
+            rule_limits = headers.get('X-Rate-Limit-%s' % rule)
+            rule_state = headers.get('X-Rate-Limit-%s-State' % rule)
+            if not rule_limits:
+                continue
+            rule_limits = [
+                self._parse_triple(part) for part in rule_limits.split(',')]
+            limits += rule_limits
+            if rule_state:
+                for (hits, _, _), (used, _, restricted) in zip(
+                        rule_limits,
+                        (self._parse_triple(part)
+                            for part in rule_state.split(','))):
+                    self.tokens = min(self.tokens, float(hits - used))
+                    if restricted > 0:
+                        self._block(now, restricted)
+        if not limits:
+            return
+
+        # The slowest sustained rate across every window wins
+        self.interval = self.margin * max(
+            period/max(1, hits) for hits, period, _ in limits)
+        self.capacity = float(max(1, min(hits for hits, _, _ in limits)))
+        self.tokens = min(self.tokens, self.capacity)
+
+    @staticmethod
+    def _parse_triple(text):
+        hits, period, restriction = text.strip().split(':')
+        return (int(hits), int(period), int(restriction))
\ No newline at end of file
@@ -0,0 +1,271 @@
+import re
+import time
+import logging
+import calendar
+import datetime
+
+import sqlalchemy
+
+from .database import Item, Sale, ItemMod, Checkpoint
+
+
+class ItemRetention:
+
+    archive_suffix = '_archive'
+    # Inactive items, and every item of a league nobody has listed in,
+    # leave the hot table after this long, taking their sales with them.
+    # Keep it above the postprocessor's 15 day stats window.
+    archive_after = int(datetime.timedelta(days=30).total_seconds())
+    # Archive periods are dropped entirely after this long; None keeps them
+    drop_after = None
+    block_size = 5000
+
+    def __init__(
+            self, db, archive_after=None, drop_after=None, block_size=None,
+            logger=logging):
+        self.db = db
+        self.logger = logger
+        if archive_after is not None:
+            self.archive_after = archive_after
+        if drop_after is not None:
+            self.drop_after = drop_after
+        if block_size is not None:
+            self.block_size = block_size
+        self.engine = db._engine
+        self.native = self.engine.dialect.name == 'postgresql'
+        self.metadata = sqlalchemy.MetaData()
+        # Each archived table and the column its periods are taken from
+        self.archived = (
+            (Item.__table__, Item.__table__.c.updated_at),
+            (Sale.__table__, Sale.__table__.c.item_updated_at))
+        self._period_re = re.compile(
+            r'^(%s)%s_(\d{4})(\d{2})$' % (
+                '|'.join(table.name for table, _ in self.archived),
+                re.escape(self.archive_suffix)))
+
+    def run(self, now=None):
+        now = int(time.time()) if now is None else now
+        archived = self.archive(now - self.archive_after)
+        dropped = []
+        if self.drop_after is not None:
+            dropped = self.drop_periods(now - self.drop_after)
+        return (archived, dropped)
+
+    def archive(self, before):
+        # Older databases may still lack item_mod and checkpoint
+        self.db.create_database()
+        # Rows the postprocessor has not reached yet stay put
+        processed = self.processed_condition()
+        dead = self.dead_leagues(before)
+        if dead:
+            self.logger.info("Archiving dead leagues: %s", ", ".join(dead))
+
+        total = 0
+        while True:
+            ids = [
+                row.id for row in self._archivable(before, dead, processed)]
+            if not ids:
+                break
+            # Sales first, as they refer to the items
+            self._move(Sale.__table__, Sale.item_id.in_(ids))
+            self.db.session.execute(
+                ItemMod.__table__.delete().where(ItemMod.item_id.in_(ids)))
+            self._move(Item.__table__, Item.id.in_(ids))
+            self.db.session.commit()
+            total += len(ids)
+            self.logger.info("Archived %s items", total)
+            if len(ids) < self.block_size:
+                break
+        return total
+
+    def dead_leagues(self, before):
+        # Served by ix_item_league_updated_at_id
+        query = self.db.session.query(
+            Item.league, sqlalchemy.func.max(Item.updated_at))
+        query = query.group_by(Item.league)
+        leagues = sorted(
+            league for league, last in query.all() if last < before)
+        self.db.session.rollback()
+        return leagues
+
+    def processed_condition(self):
+        # Items the postprocessor has handled, going by the checkpoint of
+        # their league or else the all-league one. An ended league's
+        # checkpoint stops moving, but it is past all of that league's
+        # items, so it holds back no other league.
+        checkpoints = {}
+        query = self.db.session.query(
+            Checkpoint.name, Checkpoint.league, Checkpoint.item_updated_at,
+            Checkpoint.item_id)
+        for row in query.all():
+            checkpoints.setdefault(row.name, {})[row.league] = (
+                row.item_updated_at, row.item_id)
+        self.db.session.rollback()
+
+        def reached(position):
+            updated_at, item_id = position
+            return sqlalchemy.or_(
+                Item.updated_at < updated_at,
+                sqlalchemy.and_(
+                    Item.updated_at == updated_at, Item.id <= item_id))
+
+        conditions = []
+        for positions in checkpoints.values():
+            leagues = sorted(league for league in positions if league)
+            covered = [
+                sqlalchemy.and_(
+                    Item.league == league, reached(positions[league]))
+                for league in leagues]
+            if '' in positions:
+                covered.append(sqlalchemy.and_(
+                    Item.league.notin_(leagues), reached(positions[''])))
+            conditions.append(sqlalchemy.or_(*covered))
+        if not conditions:
+            return None
+        return sqlalchemy.and_(*conditions)
+
+    def drop_periods(self, before):
+        dropped = []
+        for name, period in self.periods():
+            if self.period_bounds(period)[1] > before:
+                continue
+            table = self._period_table(self._source(name), period)
+            self.logger.info("Dropping %s", table.name)
+            table.drop(bind=self.db.session.connection())
+            self.metadata.remove(table)
+            dropped.append((name, period))
+        self.db.session.commit()
+        return dropped
+
+    def periods(self):
+        # (table name, (year, month)) of every archive period present
+        inspector = sqlalchemy.inspect(self.engine)
+        found = []
+        for name in inspector.get_table_names():
+            match = self._period_re.match(name)
+            if match:
+                found.append((
+                    match.group(1),
+                    (int(match.group(2)), int(match.group(3)))))
+        return sorted(found)
+
+    def archived_item(self, api_id):
+        for name, period in reversed(self.periods()):
+            if name != Item.__tablename__:
+                continue
+            table = self._period_table(Item.__table__, period)
+            row = self.db.session.execute(
+                table.select().where(table.c.api_id == api_id)).first()
+            if row is not None:
+                return row
+        return None
+
+    @staticmethod
+    def period(timestamp):
+        moment = time.gmtime(timestamp)
+        return (moment.tm_year, moment.tm_mon)
+
+    @staticmethod
+    def period_bounds(period):
+        year, month = period
+        following = (year + 1, 1) if month == 12 else (year, month + 1)
+        return (
+            calendar.timegm((year, month, 1, 0, 0, 0)),
+            calendar.timegm(following + (1, 0, 0, 0)))
+
+    def _source(self, name):
+        for table, column in self.archived:
+            if table.name == name:
+                return table
+        raise KeyError(name)
+
+    def _period_column(self, source):
+        for table, column in self.archived:
+            if table is source:
+                return column
+        raise KeyError(source.name)
+
+    def _archivable(self, before, dead, processed=None):
+        query = self.db.session.query(Item.id)
+        query = query.filter(Item.updated_at < before)
+        if processed is not None:
+            query = query.filter(processed)
+        if dead:
+            query = query.filter(sqlalchemy.or_(
+                Item.active == False, Item.league.in_(dead)))
+        else:
+            query = query.filter(Item.active == False)
+        query = query.order_by(Item.updated_at, Item.id)
+        return query.limit(self.block_size).all()
+
+    def _move(self, source, condition):
+        column = self._period_column(source)
+        periods = set(
+            self.period(timestamp) for (timestamp,) in self.db.session.execute(
+                sqlalchemy.select(column).where(condition).distinct()))
+        targets = []
+        for period in sorted(periods):
+            table = self._period_table(source, period)
+            start, end = self.period_bounds(period)
+            targets.append((table, sqlalchemy.and_(
+                condition, column >= start, column < end)))
+        if self.native and targets:
+            # Inserting through the parent routes rows to the partitions
+            targets = [(self._archive_table(source), condition)]
+        for table, where in targets:
+            names = [target.name for target in table.columns]
+            self.db.session.execute(table.insert().from_select(
+                names,
+                sqlalchemy.select(*[source.c[name] for name in names])
+                .where(where)))
+        self.db.session.execute(source.delete().where(condition))
+
+    def _archive_table(self, source, name=None, partitioned=False):
+        name = name or source.name + self.archive_suffix
+        if name in self.metadata.tables:
+            return self.metadata.tables[name]
+        # Same columns as the source, without the constraints tying it
+        # to other tables
+        period_column = self._period_column(source).name
+        columns = [
+            sqlalchemy.Column(
+                column.name, column.type, nullable=column.nullable,
+                primary_key=column.name in ('id', period_column),
+                autoincrement=False)
+            for column in source.columns]
+        indexes = [
+            sqlalchemy.Index(
+                'ix_%s_league_%s' % (name, period_column),
+                'league', period_column)]
+        if source is Item.__table__:
+            indexes.append(sqlalchemy.Index('ix_%s_api_id' % name, 'api_id'))
+        else:
+            indexes.append(
+                sqlalchemy.Index('ix_%s_item_id' % name, 'item_id'))
+        options = {}
+        if partitioned:
+            options['postgresql_partition_by'] = 'RANGE (%s)' % period_column
+        return sqlalchemy.Table(
+            name, self.metadata, *(columns + indexes), **options)
+
+    def _period_table(self, source, period):
+        parent_name = source.name + self.archive_suffix
+        name = '%s_%04d%02d' % ((parent_name,) + period)
+        if name in self.metadata.tables:
+            return self.metadata.tables[name]
+        # In the session's transaction; SQLite would lock out a second
+        # connection while a block is being moved
+        connection = self.db.session.connection()
+        if not self.native:
+            table = self._archive_table(source, name)
+            table.create(bind=connection, checkfirst=True)
+            return table
+
+        parent = self._archive_table(source, partitioned=True)
+        parent.create(bind=connection, checkfirst=True)
+        start, end = self.period_bounds(period)
+        connection.execute(sqlalchemy.text(
+            "CREATE TABLE IF NOT EXISTS %s PARTITION OF %s "
+            "FOR VALUES FROM (%d) TO (%d)" % (name, parent_name, start, end)))
+        # Reflected so that it can be queried and dropped like the others
+        return sqlalchemy.Table(name, self.metadata, autoload_with=connection)
\ No newline at end of file
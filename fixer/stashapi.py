@@ -1,13 +1,20 @@
 import re
-import time
+import sys
 import logging
-import datetime
+import functools
 import requests
 import requests.packages.urllib3.util.retry as urllib_retry
 import requests.adapters as requests_adapters
+import operator
+import itertools
 import rapidjson as json
 
+from .ratelimit import RateLimiter
+from .streaming import StashStreamDecoder
+
 POE_STASH_API_ENDPOINT = 'http://www.pathofexile.com/api/public-stash-tabs'
+NAME_CLEANER_RE = re.compile(r'^\<\<.*\>\>')
+MARKUP_CACHE_SIZE = 64 * 1024
 
 def requests_context():
     session = requests.Session()
@@ -22,17 +29,35 @@ def requests_context():
 
     return session
 
+@functools.lru_cache(maxsize=MARKUP_CACHE_SIZE)
+def clean_markup(value):
+    # Names repeat constantly, so share one interned string per raw value
+    if value.startswith('<<'):
+        value = NAME_CLEANER_RE.sub('', value)
+    return sys.intern(value)
+
+
+class DataField(property):
+    pass
+
+
 class PoeApiData:
 
+    __slots__ = ('_data', '_logger')
+
     fields = None
     required_fields = None
+    kind = 'data'
 
     def __init_subclass__(cls):
         def data_getter(name):
-            return property(lambda  self: self._data.get(name, None))
+            # Bind the name as a default so the getter reads a local
+            return DataField(lambda self, _name=name: self._data.get(_name))
 
         super().__init_subclass__()
         assert cls.fields, "Incorrectly initialized PoeApiData class"
+        assert '__dict__' not in dir(cls), \
+            "PoeApiData subclasses must declare __slots__"
         added = []
         for field in cls.fields:
             if field.startswith('_'):
@@ -40,11 +65,67 @@ class PoeApiData:
             if not hasattr(cls, field):
                 added += [field]
                 setattr(cls, field, data_getter(field))
+        if cls.required_fields:
+            cls._required_getter = staticmethod(
+                operator.itemgetter(*cls.required_fields))
+        cls._field_readers = {}
 
     def __init__(self, data, logger=logging):
         self._data = data
         self._logger = logger
 
+    def __reduce__(self):
+        # Loggers don't pickle, so copies get the default one
+        return (self.__class__, (self._data,))
+
+    @classmethod
+    def field_reader(cls, fields):
+        fields = tuple(fields)
+        reader = cls._field_readers.get(fields)
+        if reader is None:
+            plain = tuple(
+                field for field in fields
+                if isinstance(getattr(cls, field, None), DataField))
+            computed = tuple(field for field in fields if field not in plain)
+
+            def reader(thing):
+                row = dict(zip(plain, map(thing._data.get, plain)))
+                for field in computed:
+                    row[field] = getattr(thing, field, None)
+                return row
+
+            cls._field_readers[fields] = reader
+        return reader
+
+    @classmethod
+    def missing_field(cls, data):
+        if not cls.required_fields:
+            return None
+        try:
+            values = cls._required_getter(data)
+        except KeyError:
+            pass
+        else:
+            if len(cls.required_fields) == 1:
+                values = (values,)
+            if None not in values:
+                return None
+        for field in cls.required_fields:
+            if data.get(field, None) is None:
+                return field
+
+    @classmethod
+    def from_data(cls, data_list, logger=logging):
+        missing_field = cls.missing_field
+        for data in data_list:
+            field = missing_field(data)
+            if field is not None:
+                logger.warning(
+                    "Invalid %s: %s: %s is a required field",
+                    cls.kind, cls.__name__, field)
+                continue
+            yield cls(data, logger)
+
     def _repr_fields(self):
         def format_fields():
             for field in sorted(self.fields):
@@ -64,18 +145,18 @@ class PoeApiData:
             return "<%s()>" % self.__class__.__name__
 
     def validate(self):
-        if self.required_fields:
-            for field in self.required_fields:
-                value = self._data.get(field, None)
-                if value is None:
-                    raise ValueError(
-                        "%s: %s is a required field" % (
-                            self.__class__.__name__, field))
+        field = self.missing_field(self._data)
+        if field is not None:
+            raise ValueError(
+                "%s: %s is a required field" % (
+                    self.__class__.__name__, field))
 
 
 class ApiItem(PoeApiData):
 
-    name_cleaner_re = re.compile(r'^\<\<.*\>\>')
+    __slots__ = ('_name', '_type_line')
+    kind = 'item'
+    name_cleaner_re = NAME_CLEANER_RE
     fields = [
         "abyssJewel", "additionalProperties", "artFilename",
         "category", "corrupted", "cosmeticMods", "craftedMods",
@@ -93,19 +174,32 @@ class ApiItem(PoeApiData):
         "category", "id", "h", "w", "x", "y", "frameType", "icon",
         "identified", "ilvl", "league", "name", "typeLine", "verified"]
 
+    def __init__(self, data, logger=logging):
+        self._data = data
+        self._logger = logger
+        self._name = None
+        self._type_line = None
+
     def _clean_markup(self, value):
-        return re.sub(self.name_cleaner_re, '', value)
+        return clean_markup(value)
+
     @property
     def typeLine(self):
-        return self._clean_markup(self._data['typeLine'])
+        if self._type_line is None:
+            self._type_line = clean_markup(self._data['typeLine'])
+        return self._type_line
 
     @property
     def name(self):
-        return self._clean_markup(self._data['name'])
+        if self._name is None:
+            self._name = clean_markup(self._data['name'])
+        return self._name
 
 
 class ApiStash(PoeApiData):
 
+    __slots__ = ()
+    kind = 'stash'
     fields = [
         'accountName', 'lastCharacterName', 'id', 'stash', 'stashType',
         'items', 'public']
@@ -114,15 +208,7 @@ class ApiStash(PoeApiData):
 
     @property
     def items(self):
-
-        for item in self._data['items']:
-            api_item = ApiItem(item)
-            try:
-                api_item.validate()
-            except ValueError as e:
-                self._logger.warning("Invalid item: %s", str(e))
-                continue
-            yield api_item
+        return ApiItem.from_data(self._data['items'], logger=self._logger)
 
     @property
     def api_item_count(self):
@@ -135,67 +221,155 @@ class PoeApi:
     next_id = None
     rate = 1.1
     slow = False
+    next_id_header = 'X-Next-Change-Id'
+    next_id_re = re.compile(rb'"next_change_id"\s*:\s*"([^"]*)"')
+    stream = False
+    chunk_size = 64 * 1024
+    archive = None
 
     def __init__(
             self,
-            next_id=None, rate=None, slow=None, api_root=None, logger=logging):
+            next_id=None, rate=None, slow=None, api_root=None, stream=None,
+            limiter=None, archive=None, logger=logging):
         self.logger = logger
         self.next_id = next_id
         if rate is not None:
-            self.rate = datetime.timedelta(seconds=rate)
+            self.rate = rate
         if slow is not None:
             self.slow = slow
         if api_root is not None:
             self.api_root = api_root
-        self.last_time = None
+        if stream is not None:
+            self.stream = stream
+        if archive is not None:
+            self.archive = archive
+        self.limiter = limiter or RateLimiter(interval=self.rate, logger=logger)
         self.rq_context = requests_context()
 
     def rate_wait(self):
-        if self.last_time:
-            now = datetime.datetime.now()
-            delta = now - self.last_time
-            if delta.total_seconds() < self.rate:
-                remaining = self.rate - delta.total_seconds()
-                time.sleep(remaining)
-        self.set_last_time()
+        self.limiter.wait()
 
     def set_last_time(self):
-        self.last_time = datetime.datetime.now()
+        self.limiter.restart()
 
     def get_next(self):
         self.rate_wait()
+        if self.stream:
+            response = self._request(next_id=self.next_id, slow=self.slow)
+            stashes, self.next_id = self._decode_stream(
+                response, response.headers.get(self.next_id_header))
+            return self.stash_generator(stashes)
         data, self.next_id = self._get_data(next_id=self.next_id, slow=self.slow)
         return self.stash_generator(data)
 
-    @staticmethod
-    def stash_generator(data):
-        for stash in data:
-            api_stash = ApiStash(stash)
-            try:
-                api_stash.validate()
-            except ValueError as e:
-                self.logger.warning("Invalid stash: %s", str(e))
-                continue
-            yield api_stash
+    def fetch_next(self):
+        self.rate_wait()
+        response, self.next_id = self._fetch(
+            next_id=self.next_id, slow=self.slow)
+        return response
+
+    def decode_next(self, response):
+        if self.stream:
+            # The fetch thread may already have moved self.next_id on
+            data, _ = self._decode_stream(response, response.next_change_id)
+        else:
+            data, new_id = self._decode(response.content)
+            self._archive_page(response, new_id)
+        return self.stash_generator(data)
+
+    def stash_generator(self, data):
+        return ApiStash.from_data(data, logger=self.logger)
 
     def _get_data(self, next_id=None, slow=False):
+        response, _ = self._fetch(next_id=next_id, slow=slow)
+        data, new_id = self._decode(response.content)
+        self._archive_page(response, new_id)
+        return (data, new_id)
+
+    def _archive_page(self, response, new_id):
+        if self.archive is not None:
+            self.archive.append(response.change_id, new_id, response.content)
+
+    def _archive_chunks(self, record, chunks):
+        for chunk in chunks:
+            record.write(chunk)
+            yield chunk
+        record.finish()
+
+    def _request(self, next_id=None, slow=False):
         url = self.api_root
         if next_id:
             self.logger.info("Requesting next stash set: %s" % next_id)
             url += '?id=' + next_id
         else:
             self.logger.info("Requesting first stash set")
-        req = self.rq_context.get(url)
-        if slow:
-            self.set_last_time()
+        while True:
+            req = self.rq_context.get(url, stream=True)
+            if slow:
+                self.set_last_time()
+            self.limiter.update(req.headers, req.status_code)
+            if req.status_code != 429:
+                break
+            req.close()
+            self.rate_wait()
         req.raise_for_status()
-        self.logger.debug("Acquired stash data")
-        data = json.loads(req.text)
+        req.change_id = next_id
+        self.logger.debug(
+            "Acquired stash headers, rate limiter: %r", self.limiter.stats())
+        return req
+
+    def _fetch(self, next_id=None, slow=False):
+        req = self._request(next_id=next_id, slow=slow)
+        new_id = req.headers.get(self.next_id_header)
+        if new_id is None:
+            # Older servers only carry the id in the body, where it comes
+            # first, so avoid a full decode just to find it.
+            match = self.next_id_re.search(req.content)
+            if not match:
+                raise KeyError(
+                    'next_change_id required field not present in response')
+            new_id = match.group(1).decode('utf-8')
+        req.next_change_id = new_id
+        return (req, new_id)
+
+    def _decode(self, content):
+        data = json.loads(content)
         self.logger.debug("Loaded stash data from JSON")
         if 'next_change_id' not in data:
             raise KeyError('next_change_id required field not present in response')
         return (data['stashes'], data['next_change_id'])
 
+    def _decode_stream(self, response, next_id=None):
+        chunks = response.iter_content(chunk_size=self.chunk_size)
+        record = None
+        if self.archive is not None:
+            record = self.archive.record(response.change_id)
+            chunks = self._archive_chunks(record, chunks)
+        events = StashStreamDecoder(chunks).events()
+        early = []
+        if next_id is None:
+            # Anything ahead of the id in the body has to be held back
+            for kind, value in events:
+                if kind == 'next_change_id':
+                    next_id = value
+                    break
+                early.append(value)
+            else:
+                raise KeyError(
+                    'next_change_id required field not present in response')
+        if record is not None:
+            record.set_next_id(next_id)
+
+        def stashes():
+            for kind, value in events:
+                if kind == 'stash':
+                    yield value
+            # Drain any trailing bytes so an archive record sees the end
+            for _ in chunks:
+                pass
+
+        return (itertools.chain(early, stashes()), next_id)
+
 if __name__ == '__main__':
     api = PoeApi()
     stashes = api.get_next()
@@ -0,0 +1,119 @@
+import re
+import rapidjson as json
+
+
+_WHITESPACE_RE = re.compile(rb'[ \t\r\n]*')
+_STRUCTURE_RE = re.compile(rb'["{}\[\]]')
+_STRING_END_RE = re.compile(rb'["\\]')
+_SCALAR_END_RE = re.compile(rb'[,}\] \t\r\n]')
+
+
+def _scan_string(buf, pos):
+    index = pos + 1
+    while True:
+        match = _STRING_END_RE.search(buf, index)
+        if match is None:
+            return None
+        if match.group() == b'\\':
+            index = match.end() + 1
+            continue
+        return match.end()
+
+
+def _scan_value(buf, pos):
+    first = buf[pos:pos+1]
+    if first == b'"':
+        return _scan_string(buf, pos)
+    if first not in (b'{', b'['):
+        match = _SCALAR_END_RE.search(buf, pos)
+        return match.start() if match else None
+
+    depth = 0
+    index = pos
+    while True:
+        match = _STRUCTURE_RE.search(buf, index)
+        if match is None:
+            return None
+        char = match.group()
+        if char == b'"':
+            index = _scan_string(buf, match.start())
+            if index is None:
+                return None
+            continue
+        depth += 1 if char in b'{[' else -1
+        index = match.end()
+        if depth == 0:
+            return index
+
+
+class StashStreamDecoder:
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = b''
+        self._pos = 0
+
+    def events(self):
+        self._expect(b'{')
+        while True:
+            self._skip_whitespace()
+            if self._buf[self._pos:self._pos+1] == b'}':
+                self._pos += 1
+                return
+            key = json.loads(self._read(_scan_string))
+            self._expect(b':')
+            self._skip_whitespace()
+            if key == 'stashes':
+                for stash in self._array_values():
+                    yield ('stash', stash)
+            else:
+                value = json.loads(self._read(_scan_value))
+                if key == 'next_change_id':
+                    yield ('next_change_id', value)
+            if self._expect(b',}') == b'}':
+                return
+
+    def _array_values(self):
+        self._expect(b'[')
+        self._skip_whitespace()
+        if self._buf[self._pos:self._pos+1] == b']':
+            self._pos += 1
+            return
+        while True:
+            self._skip_whitespace()
+            yield json.loads(self._read(_scan_value))
+            if self._expect(b',]') == b']':
+                return
+
+    def _fill(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            raise ValueError("Stash stream ended in the middle of a value")
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+
+    def _skip_whitespace(self):
+        while True:
+            self._pos = _WHITESPACE_RE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return
+            self._fill()
+
+    def _expect(self, choices):
+        self._skip_whitespace()
+        char = self._buf[self._pos:self._pos+1]
+        if char not in choices:
+            raise ValueError(
+                "Unexpected %r in stash stream, wanted one of %r" % (
+                    char, choices))
+        self._pos += 1
+        return char
+
+    def _read(self, scanner):
+        while True:
+            end = scanner(self._buf, self._pos)
+            if end is not None:
+                value = self._buf[self._pos:end]
+                self._pos = end
+                return value
+            self._fill()
\ No newline at end of file
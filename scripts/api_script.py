@@ -1,11 +1,14 @@
 import json
 import logging
 import argparse
+import threading
 
 import requests
+import sqlalchemy
 
 import fixer
 import fixer.logger as plogger
+from fixer.postprocessing.processor import CurrencyPostprocessor
 
 
 DEFAULT_DSN='sqlite:///:memory:'
@@ -24,12 +27,60 @@ def parse_args():
     parser.add_argument(
         '--most-recent', action='store_true',
         help='Consult poe.ninja to find latest ID')
+    parser.add_argument(
+        '--batch', action='store_true',
+        help='Write each page of stashes with bulk upserts')
+    parser.add_argument(
+        '--pipeline', action='store_true',
+        help='Fetch, decode and store pages concurrently (implies --batch)')
+    parser.add_argument(
+        '-w', '--workers', action='store', type=int,
+        help='Write stashes from this many processes, split by stash id '
+        '(needs a server database)')
+    parser.add_argument(
+        '--stream', action='store_true',
+        help='Decode stash pages incrementally as they download')
+    parser.add_argument(
+        '--archive', action='store',
+        help='Directory to record raw stash pages into')
+    parser.add_argument(
+        '--replay', action='store',
+        help='Directory of recorded stash pages to ingest instead of the API')
+    parser.add_argument(
+        '--normalize-mods', action='store_true',
+        help='Also write item mods and properties to the mod tables')
+    parser.add_argument(
+        '--postprocess', action='store_true',
+        help='Extract sales in this process as items are written '
+        '(needs a file or server database)')
     parser.add_argument(
         'next_id', action='store', nargs='?',
         help='The next id to start at')
     return parser.parse_args()
 
-def pull_data(database_dsn, next_id, most_recent, logger):
+def start_postprocessor(database_dsn, notifier, logger):
+    # Its own PoeDb, as sessions are not shared between threads
+    db = fixer.PoeDb(db_connect=database_dsn, logger=logger)
+    processor = CurrencyPostprocessor(
+        db, None, continuous=True, notifier=notifier, logger=logger)
+    thread = threading.Thread(
+        target=processor.do_currency_postprocessor,
+        name='poefixer-postprocess', daemon=True)
+    thread.start()
+    return processor, thread
+
+
+def pull_data(
+        database_dsn, next_id, most_recent, logger,
+        batch=False, pipeline=False, stream=False, archive=None,
+        replay=None, workers=None, postprocess=False, normalize_mods=False,
+        log_level=logging.WARNING):
+
+    url = sqlalchemy.engine.make_url(database_dsn)
+    if (postprocess and url.get_backend_name() == 'sqlite' and
+            url.database in (None, '', ':memory:')):
+        # The postprocessor would get a separate, empty database
+        raise ValueError("Cannot postprocess an in-memory database")
 
     if most_recent:
         if next_id:
@@ -39,15 +90,68 @@ def pull_data(database_dsn, next_id, most_recent, logger):
         data = json.loads(result.text)
         next_id = data['next_change_id']
 
-    db = fixer.PoeDb(db_connect=database_dsn, logger=logger)
-    api = fixer.PoeApi(logger=logger, next_id=next_id)
+    db = fixer.PoeDb(
+        db_connect=database_dsn, normalize_mods=normalize_mods, logger=logger)
+    if replay:
+        api = fixer.ReplayPoeApi(
+            replay, logger=logger, next_id=next_id, stream=stream)
+    else:
+        if archive:
+            archive = fixer.PageArchive(archive, logger=logger)
+        api = fixer.PoeApi(
+            logger=logger, next_id=next_id, stream=stream, archive=archive)
 
     db.create_database()
 
+    if postprocess:
+        # Parallel ingest workers can only reach a database notifier;
+        # without one the postprocessor falls back to polling.
+        notifier = fixer.database_notifier(db, logger=logger)
+        if notifier is None and not workers:
+            notifier = fixer.LocalNotifier(logger=logger)
+        db.notifier = notifier
+        processor, thread = start_postprocessor(
+            database_dsn, notifier, logger)
+
+    ingest(
+        api, db, database_dsn, logger, batch=batch, pipeline=pipeline,
+        workers=workers, normalize_mods=normalize_mods, log_level=log_level)
+
+    if postprocess:
+        # The source ran out; sales for the items written so far are
+        # still to be extracted
+        logger.info("Ingest finished, waiting for the postprocessor...")
+        processor.stop()
+        thread.join()
+
+
+def ingest(
+        api, db, database_dsn, logger, batch=False, pipeline=False,
+        workers=None, normalize_mods=False, log_level=logging.WARNING):
+
+    if workers:
+        fixer.ParallelIngest(
+            api, database_dsn, workers=workers, normalize_mods=normalize_mods,
+            log_level=log_level, logger=logger).run()
+        return
+
+    if pipeline:
+        fixer.IngestPipeline(api, db, logger=logger).run()
+        return
+
     while True:
-        for stash in api.get_next():
-            logger.debug("Inserting stash...")
-            db.insert_api_stash(stash, with_items=True)
+        try:
+            stashes = api.get_next()
+        except EOFError as e:
+            logger.info("Replay complete: %s", e)
+            break
+        if batch:
+            logger.debug("Inserting stash page...")
+            db.insert_api_stashes(stashes, with_items=True)
+        else:
+            for stash in stashes:
+                logger.debug("Inserting stash...")
+                db.insert_api_stash(stash, with_items=True)
         logger.info("Stash pass complete.")
         db.session.commit()
 
@@ -62,10 +166,19 @@ if __name__ == '__main__':
     else:
         level = 'WARNING'
     logging.basicConfig(level=level)
-    logger = plogger.get_fixer_logger(level)
+    logger = plogger.get_poefixer_logger(level)
 
     pull_data(
         database_dsn=options.database_dsn,
         next_id=options.next_id,
         most_recent=options.most_recent,
-        logger=logger)
\ No newline at end of file
+        logger=logger,
+        batch=options.batch,
+        pipeline=options.pipeline,
+        stream=options.stream,
+        archive=options.archive,
+        replay=options.replay,
+        workers=options.workers,
+        postprocess=options.postprocess,
+        normalize_mods=options.normalize_mods,
+        log_level=level)
\ No newline at end of file
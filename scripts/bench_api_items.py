@@ -0,0 +1,119 @@
+import re
+import time
+import logging
+import argparse
+import tracemalloc
+
+import fixer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Microbenchmark ApiItem construction and field access')
+    parser.add_argument(
+        '-n', '--items', action='store', type=int, default=20000,
+        help='Items per synthetic page')
+    parser.add_argument(
+        '-r', '--repeat', action='store', type=int, default=5,
+        help='Timed passes, the best one is reported')
+    return parser.parse_args()
+
+
+class LegacyApiItem:
+    # The pre-__slots__ implementation, kept here as the baseline
+
+    name_cleaner_re = re.compile(r'^\<\<.*\>\>')
+    fields = fixer.ApiItem.fields
+    required_fields = fixer.ApiItem.required_fields
+
+    def __init__(self, data, logger=logging):
+        self._data = data
+        self._logger = logger
+
+    def validate(self):
+        for field in self.required_fields:
+            if self._data.get(field, None) is None:
+                raise ValueError("%s is a required field" % field)
+
+    def _clean_markup(self, value):
+        return re.sub(self.name_cleaner_re, '', value)
+
+    @property
+    def typeLine(self):
+        return self._clean_markup(self._data['typeLine'])
+
+    @property
+    def name(self):
+        return self._clean_markup(self._data['name'])
+
+
+def _legacy_getter(name):
+    return property(lambda self: self._data.get(name, None))
+
+
+for _field in LegacyApiItem.fields:
+    if not hasattr(LegacyApiItem, _field):
+        setattr(LegacyApiItem, _field, _legacy_getter(_field))
+
+
+def legacy_items(data_list):
+    for data in data_list:
+        item = LegacyApiItem(data)
+        try:
+            item.validate()
+        except ValueError:
+            continue
+        yield item
+
+
+def make_page(count):
+    names = ['', '<<set:MS>><<set:M>><<set:S>>Kaom\'s Heart', 'Doom Ward']
+    bases = ['Chaos Orb', 'Glorious Plate', 'Vaal Regalia', 'Exalted Orb']
+    for index in range(count):
+        yield {
+            'id': '%064x' % index, 'league': 'Standard', 'verified': False,
+            'w': 2, 'h': 3, 'x': index % 12, 'y': index % 5, 'ilvl': 70,
+            'icon': 'https://web.poecdn.com/image/Art/2DItems/x.png',
+            'name': names[index % len(names)],
+            'typeLine': bases[index % len(bases)],
+            'identified': True, 'corrupted': False, 'frameType': 3,
+            'category': {'armour': ['chest']}, 'note': '~price 1 chaos',
+            'explicitMods': ['+90 to maximum Life', '+30% to Fire Resistance'],
+            'properties': [{'name': 'Armour', 'values': [['500', 1]]}]}
+
+
+def legacy_reader(item):
+    return dict(
+        (field, getattr(item, field, None))
+        for field in fixer.PoeDb.item_simple_fields)
+
+
+def run(label, factory, read_fields, page, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in factory(page):
+            read_fields(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    items = list(factory(page))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("%-8s %8.3f us/item %8.1f bytes/item" % (
+        label, best * 1e6 / len(page), size / len(items)))
+    return best
+
+
+if __name__ == '__main__':
+    options = parse_args()
+    page = list(make_page(options.items))
+    legacy = run(
+        'legacy', legacy_items, legacy_reader, page, options.repeat)
+    current = run(
+        'ApiItem', fixer.ApiItem.from_data,
+        fixer.ApiItem.field_reader(fixer.PoeDb.item_simple_fields),
+        page, options.repeat)
+    print("speedup  %8.2fx" % (legacy / current))
\ No newline at end of file
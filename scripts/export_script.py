@@ -0,0 +1,45 @@
+import logging
+import argparse
+
+import fixer
+import fixer.logger as plogger
+from fixer.export import ColumnarExporter, EXPORT_SPECS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--verbose', action='store_true', help='Verbose output')
+    parser.add_argument(
+        '--debug', action='store_true', help='Debugging output')
+    parser.add_argument(
+        '-d', '--database-dsn', action='store', required=True,
+        help='Database connection string for SQLAlchemy')
+    parser.add_argument(
+        '-t', '--table', action='append', choices=sorted(EXPORT_SPECS),
+        help='Export only this table (may be repeated)')
+    parser.add_argument(
+        '--block-size', action='store', type=int,
+        help='Rows read from the database per exported block')
+    parser.add_argument(
+        'directory', action='store',
+        help='Directory to write the partitioned Parquet files to')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    options = parse_args()
+
+    if options.debug:
+        level = 'DEBUG'
+    elif options.verbose:
+        level = 'INFO'
+    else:
+        level = 'WARNING'
+    logging.basicConfig(level=level)
+    logger = plogger.get_poefixer_logger(level)
+
+    db = fixer.PoeDb(db_connect=options.database_dsn, logger=logger)
+    ColumnarExporter(
+        db, options.directory, tables=options.table,
+        block_size=options.block_size, logger=logger).export()
\ No newline at end of file
@@ -0,0 +1,63 @@
+import logging
+import argparse
+
+import fixer
+import fixer.logger as plogger
+from fixer.postprocessing.processor import CurrencyPostprocessor
+from fixer.postprocessing.parallel import ParallelPostprocessor
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--verbose', action='store_true', help='Verbose output')
+    parser.add_argument(
+        '--debug', action='store_true', help='Debugging output')
+    parser.add_argument(
+        '-d', '--database-dsn', action='store', required=True,
+        help='Database connection string for SQLAlchemy')
+    parser.add_argument(
+        '-w', '--workers', action='store', type=int,
+        help='Extract sales from this many processes, split by league '
+        '(needs a server database)')
+    parser.add_argument(
+        '--continuous', action='store_true',
+        help='Keep extracting sales as new items are written')
+    parser.add_argument(
+        '--start-time', action='store', type=int,
+        help='Process items updated since this Unix time, '
+        'instead of resuming from the checkpoint')
+    parser.add_argument(
+        '--limit', action='store', type=int,
+        help='Stop a pass after about this many rows')
+    parser.add_argument(
+        '--block-size', action='store', type=int,
+        help='Items read from the database per block')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    options = parse_args()
+
+    if options.debug:
+        level = 'DEBUG'
+    elif options.verbose:
+        level = 'INFO'
+    else:
+        level = 'WARNING'
+    logging.basicConfig(level=level)
+    logger = plogger.get_poefixer_logger(level)
+
+    if options.workers and options.workers > 1:
+        ParallelPostprocessor(
+            options.database_dsn, start_time=options.start_time,
+            workers=options.workers, continuous=options.continuous,
+            limit=options.limit, block_size=options.block_size,
+            log_level=level, logger=logger).run()
+    else:
+        db = fixer.PoeDb(db_connect=options.database_dsn, logger=logger)
+        CurrencyPostprocessor(
+            db, options.start_time, continuous=options.continuous,
+            limit=options.limit, block_size=options.block_size,
+            notifier=fixer.database_notifier(db, logger=logger),
+            logger=logger).do_currency_postprocessor()
@@ -0,0 +1,138 @@
+import json
+import time
+import logging
+import argparse
+import threading
+import http.server
+import urllib.parse
+
+import fixer
+import fixer.logger as plogger
+from fixer.postprocessing.price_index import PriceIndex
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--verbose', action='store_true', help='Verbose output')
+    parser.add_argument(
+        '--debug', action='store_true', help='Debugging output')
+    parser.add_argument(
+        '-d', '--database-dsn', action='store', required=True,
+        help='Database connection string for SQLAlchemy')
+    parser.add_argument(
+        '--host', action='store', default='127.0.0.1',
+        help='Address to serve on')
+    parser.add_argument(
+        '-p', '--port', action='store', type=int, default=8088,
+        help='Port to serve on')
+    parser.add_argument(
+        '--refresh', action='store', type=float, default=5,
+        help='Seconds between incremental refreshes of the index')
+    return parser.parse_args()
+
+
+class PriceHandler(http.server.BaseHTTPRequestHandler):
+
+    # Set on the class by serve()
+    index = None
+    logger = logging
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == '/leagues':
+            self.send_json(200, self.index.leagues())
+        elif url.path == '/price':
+            name = query.get('name', [None])[0]
+            league = query.get('league', [None])[0]
+            if not name or not league:
+                self.send_json(400, {'error': 'name and league are required'})
+                return
+            price = self.index.price(name, league)
+            if price is None:
+                self.send_json(404, {'error': 'no price for %s' % name})
+            else:
+                self.send_json(200, price)
+        else:
+            self.send_json(404, {'error': 'unknown path'})
+
+    def do_POST(self):
+        # Body: {"league": ..., "names": [...]} or [{"name", "league"}, ...]
+        if urllib.parse.urlsplit(self.path).path != '/prices':
+            self.send_json(404, {'error': 'unknown path'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length))
+            if isinstance(body, dict):
+                queries = [(name, body['league']) for name in body['names']]
+            else:
+                queries = [(entry['name'], entry['league']) for entry in body]
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': 'bad request: %s' % e})
+            return
+        self.send_json(200, self.index.prices(queries))
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def keep_fresh(index, interval, logger):
+    while True:
+        time.sleep(interval)
+        try:
+            index.refresh()
+        except Exception:
+            # Keep serving the last good index until the database is back
+            logger.exception("Price index refresh failed")
+
+
+def serve(database_dsn, host, port, refresh, logger):
+    db = fixer.PoeDb(db_connect=database_dsn, logger=logger)
+    index = PriceIndex(db, logger=logger)
+    index.refresh()
+
+    thread = threading.Thread(
+        target=keep_fresh, args=(index, refresh, logger),
+        name='poefixer-price-refresh', daemon=True)
+    thread.start()
+
+    PriceHandler.index = index
+    PriceHandler.logger = logger
+    server = http.server.ThreadingHTTPServer((host, port), PriceHandler)
+    logger.info("Serving prices on %s:%s", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping price server")
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    options = parse_args()
+
+    if options.debug:
+        level = 'DEBUG'
+    elif options.verbose:
+        level = 'INFO'
+    else:
+        level = 'WARNING'
+    logging.basicConfig(level=level)
+    logger = plogger.get_poefixer_logger(level)
+
+    serve(
+        database_dsn=options.database_dsn,
+        host=options.host,
+        port=options.port,
+        refresh=options.refresh,
+        logger=logger)
\ No newline at end of file
@@ -0,0 +1,84 @@
+import os
+import gzip
+import logging
+import argparse
+import http.server
+import urllib.parse
+
+import rapidjson as json
+
+import fixer.logger as plogger
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Serve recorded stash pages in place of the PoE API')
+    parser.add_argument(
+        '--verbose', action='store_true', help='Verbose output')
+    parser.add_argument(
+        '--host', action='store', default='127.0.0.1',
+        help='Address to listen on')
+    parser.add_argument(
+        '-p', '--port', action='store', type=int, default=8080,
+        help='Port to listen on')
+    parser.add_argument(
+        'pages', action='store',
+        help='Directory of recorded page files, replayed in name order')
+    return parser.parse_args()
+
+
+def load_pages(directory):
+    pages = {}
+    next_id = None
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        with open(os.path.join(directory, filename), 'rb') as page_file:
+            content = page_file.read()
+        page_id = next_id
+        next_id = json.loads(content)['next_change_id']
+        pages[page_id] = (content, next_id)
+    return pages
+
+
+class ReplayHandler(http.server.BaseHTTPRequestHandler):
+
+    pages = {}
+    logger = logging
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        next_id = query.get('id', [None])[0]
+        if next_id not in self.pages:
+            self.send_error(404, "No recorded page for id %s" % next_id)
+            return
+        content, new_id = self.pages[next_id]
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Next-Change-Id', new_id)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            content = gzip.compress(content)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        self.logger.info(format, *args)
+
+
+if __name__ == '__main__':
+    options = parse_args()
+
+    level = 'INFO' if options.verbose else 'WARNING'
+    logging.basicConfig(level=level)
+    ReplayHandler.logger = plogger.get_poefixer_logger(level)
+    ReplayHandler.pages = load_pages(options.pages)
+
+    server = http.server.ThreadingHTTPServer(
+        (options.host, options.port), ReplayHandler)
+    ReplayHandler.logger.warning(
+        "Replaying %s pages on http://%s:%s/",
+        len(ReplayHandler.pages), options.host, options.port)
+    server.serve_forever()
\ No newline at end of file
@@ -0,0 +1,51 @@
+import logging
+import argparse
+import datetime
+
+import fixer
+import fixer.logger as plogger
+
+
+def days(value):
+    return int(datetime.timedelta(days=float(value)).total_seconds())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--verbose', action='store_true', help='Verbose output')
+    parser.add_argument(
+        '--debug', action='store_true', help='Debugging output')
+    parser.add_argument(
+        '-d', '--database-dsn', action='store', required=True,
+        help='Database connection string for SQLAlchemy')
+    parser.add_argument(
+        '--archive-after', action='store', type=days,
+        help='Archive inactive and dead-league items, with their sales, '
+             'older than this many days')
+    parser.add_argument(
+        '--drop-after', action='store', type=days,
+        help='Drop item and sale archive months that ended more than this '
+             'many days ago')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    options = parse_args()
+
+    if options.debug:
+        level = 'DEBUG'
+    elif options.verbose:
+        level = 'INFO'
+    else:
+        level = 'WARNING'
+    logging.basicConfig(level=level)
+    logger = plogger.get_poefixer_logger(level)
+
+    db = fixer.PoeDb(db_connect=options.database_dsn, logger=logger)
+    retention = fixer.ItemRetention(
+        db, archive_after=options.archive_after,
+        drop_after=options.drop_after, logger=logger)
+    archived, dropped = retention.run()
+    logger.info(
+        "Archived %s items, dropped %s archive months", archived, len(dropped))
\ No newline at end of file
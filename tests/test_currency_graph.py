@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from fixer.postprocessing.currency_graph import CHAOS, CurrencyGraph
+
+
+LEAGUE = 'Standard'
+CURRENCIES = [CHAOS] + ['Currency %s' % index for index in range(8)]
+
+
+def rebuilt(graph):
+    fresh = CurrencyGraph()
+    for league, edges in graph.leagues.items():
+        for from_currency, targets in edges.items():
+            for to_currency, edge in targets.items():
+                fresh.update(
+                    from_currency, to_currency, league,
+                    edge.mean, edge.weight)
+    return fresh
+
+
+def check_paths(paths, expected, link):
+    assert set(paths.width) == set(expected.width)
+    for node, width in expected.width.items():
+        assert paths.width[node] == width
+        if node == CHAOS:
+            continue
+        # Routes may differ where two are equally wide, but each one
+        # kept must be what its own edge and next node give.
+        target = paths.next[node]
+        route_width, mean = link(node, target, paths.width[target])
+        assert route_width == width
+        assert paths.rate[node] == pytest.approx(
+            mean * paths.rate[target], rel=1e-12)
+        assert paths.hops[node] == paths.hops[target] + 1
+        assert node in paths.children[target]
+    for target, children in paths.children.items():
+        for node in children:
+            assert paths.next[node] == target
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_incremental_paths_match_rebuild(seed):
+    rng = random.Random(seed)
+    graph = CurrencyGraph()
+    for step in range(300):
+        from_currency, to_currency = rng.sample(CURRENCIES, 2)
+        existing = graph.edge(from_currency, to_currency, LEAGUE)
+        if existing is not None and rng.random() < 0.5:
+            # Same weight, new mean: routes stay, rates change
+            weight = existing.weight
+        else:
+            weight = rng.choice([rng.uniform(0, 100), rng.randint(1, 5)])
+        graph.update(
+            from_currency, to_currency, LEAGUE,
+            rng.uniform(0.01, 50), weight)
+        # Build both path sets early so later updates are incremental
+        graph.find_rate(CURRENCIES[1], LEAGUE)
+        graph._league_fallback_paths(LEAGUE)
+
+        fresh = rebuilt(graph)
+        check_paths(
+            graph._league_paths(LEAGUE), fresh._league_paths(LEAGUE),
+            graph._forward_link(LEAGUE))
+        check_paths(
+            graph._league_fallback_paths(LEAGUE),
+            fresh._league_fallback_paths(LEAGUE),
+            graph._all_link(LEAGUE))
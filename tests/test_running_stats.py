@@ -0,0 +1,90 @@
+import math
+import random
+
+import numpy
+import pytest
+
+from fixer.postprocessing.running_stats import (
+    DECAY_COEFFS, DECAY_RATES, RunningStats, SaleStats)
+
+
+RELEVANT = 15 * 24 * 3600
+WEIGHT_INCREMENT = 12 * 3600
+KEY = ('Exalted Orb', 'Chaos Orb', 'Standard')
+
+
+def exact_mean_and_std(sales, sale_time, now):
+    # The query-everything weighting RunningStats replaces
+    values = numpy.array([
+        (price, WEIGHT_INCREMENT/max(1, sale_time-when))
+        for when, price in sales if when > now-RELEVANT])
+    if len(values) == 0:
+        return (None, None, None, None)
+
+    def calc_mean_std(prices, weights):
+        mean = numpy.average(prices, weights=weights)
+        variance = numpy.average((prices-mean)**2, weights=weights)
+        return (mean, math.sqrt(variance))
+
+    prices = values[:, 0]
+    weights = values[:, 1]
+    mean, stddev = calc_mean_std(prices, weights)
+    count = len(prices)
+    total_weight = weights.sum()
+    if count > 3 and stddev > mean/2:
+        prices_ok = numpy.absolute(prices-mean) <= stddev*2
+        prices = numpy.extract(prices_ok, prices)
+        weights = numpy.extract(prices_ok, weights)
+        mean, stddev = calc_mean_std(prices, weights)
+        count = len(prices)
+        total_weight = weights.sum()
+    return (float(mean), float(stddev), float(total_weight), count)
+
+
+def sale_sequence(rng, steps):
+    # (sale_time, price, now, resold) with mostly increasing sale times,
+    # some arriving out of order and some replacing an earlier sale
+    now = 1500000000
+    sale_time = now
+    for _ in range(steps):
+        now += rng.choice([0, 1, 60, 3600, 86400])
+        if rng.random() < 0.15:
+            when = sale_time - rng.randint(1, 5*86400)
+        else:
+            sale_time = min(now, sale_time + rng.randint(0, 7200))
+            when = sale_time
+        price = rng.choice([
+            rng.uniform(80, 120), rng.uniform(1, 400), rng.randint(90, 110)])
+        yield (when, price, now, rng.random() < 0.2)
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_running_stats_match_exact_weighting(seed):
+    rng = random.Random(seed)
+    running = RunningStats(RELEVANT, WEIGHT_INCREMENT)
+    running.stats[KEY] = SaleStats()
+    sales = []
+    for when, price, now, resold in sale_sequence(rng, 400):
+        if resold and sales:
+            old = rng.choice(sales)
+            sales.remove(old)
+            running.remove(*KEY, *old)
+        sales.append((when, price))
+        running.add(*KEY, when, price)
+
+        expected = exact_mean_and_std(sales, when, now)
+        actual = running.mean_and_std(None, *KEY, when, now)
+        if expected[0] is None:
+            assert actual == (None, None, None, None)
+            continue
+        assert actual[3] == expected[3]
+        assert actual[0] == pytest.approx(expected[0], rel=1e-5)
+        assert actual[1] == pytest.approx(expected[1], abs=1e-5*expected[0])
+        assert actual[2] == pytest.approx(expected[2], rel=1e-5)
+
+
+def test_decay_terms_approximate_inverse_age():
+    ages = numpy.concatenate([
+        numpy.arange(1, 1000), numpy.geomspace(1000, 31*86400, 20000)])
+    approx = numpy.exp(-numpy.outer(ages, DECAY_RATES)).dot(DECAY_COEFFS)
+    assert numpy.abs(approx - 1/ages).max() < 2e-6